@@ -0,0 +1,94 @@
+"""Benchmark: personalized feed read via $in over follows vs the materialized home timeline.
+
+Seeds a scratch database (<DB_NAME>_bench) where one reader follows N authors
+(each with a few snapshots), fans the snapshots out into the reader's
+timeline, then reports p50/p95 latency of a 20-item feed page for N = 10,
+1k and 10k. The sparse rows repeat each N with only a handful of authors
+posting, so the materialized page comes up short and the read falls back.
+Uses MONGO_URL / DB_NAME / JWT_* from backend/.env.
+
+    python benchmarks/bench_home_timeline.py --rounds 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+import server  # noqa: E402
+
+READER = "bench-reader"
+POSTS_PER_AUTHOR = 3
+SPARSE_ACTIVE_AUTHORS = 3
+PAGE = 20
+
+
+async def read_fan_out(limit: int = PAGE):
+    """Fan-out-on-read: every follow edge, then a $in over all followed authors"""
+    following = await server.db.social_graph.find({"follower_id": READER}, {"following_id": 1}).to_list(None)
+    query = {"user_id": {"$in": [f['following_id'] for f in following]}}
+    return await server.db.css_snapshots.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+
+
+async def read_timeline(limit: int = PAGE):
+    return await server.timelines.read(READER, limit)
+
+
+async def seed(follows: int, active: int):
+    db = server.db
+    for name in ("social_graph", "css_snapshots", "timelines", "profiles"):
+        await db[name].delete_many({})
+    authors = [str(uuid.uuid4()) for _ in range(follows)]
+    start = datetime.now(timezone.utc) - timedelta(days=1)
+    await db.social_graph.insert_many([{"id": str(uuid.uuid4()), "follower_id": READER, "following_id": a} for a in authors])
+    snapshots = [
+        {"id": str(uuid.uuid4()), "user_id": a, "color": "#8B9DC3", "light_frequency": 0.5, "sound_texture": "flowing",
+         "emotion_label": "Bench", "description": "", "timestamp": (start + timedelta(seconds=i * POSTS_PER_AUTHOR + p)).isoformat()}
+        for i, a in enumerate(authors[:active]) for p in range(POSTS_PER_AUTHOR)
+    ]
+    for i in range(0, len(snapshots), 5000):
+        await db.css_snapshots.insert_many(snapshots[i:i + 5000])
+        await db.timelines.insert_many([server.HomeTimelines._entry(READER, dict(s)) for s in snapshots[i:i + 5000]])
+
+
+async def measure(read, rounds: int):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await read()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[max(0, int(len(latencies) * 0.95) - 1)]
+
+
+async def main(rounds: int):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db_name = f"{os.environ['DB_NAME']}_bench"
+    server.db = client[db_name]
+    await server.create_indexes()
+
+    print(f"{'follows':>8} | {'posting':<6} | {'variant':<12} | {'p50 ms':>8} | {'p95 ms':>8}")
+    for follows in (10, 1000, 10000):
+        for posting, active in (("all", follows), ("sparse", SPARSE_ACTIVE_AUTHORS)):
+            await seed(follows, active)
+            server.timelines.high_fanout_loaded_at = 0
+            for label, read in (("fan-out-read", read_fan_out), ("timeline", read_timeline)):
+                p50, p95 = await measure(read, rounds)
+                print(f"{follows:>8} | {posting:<6} | {label:<12} | {p50:>8.2f} | {p95:>8.2f}")
+
+    await client.drop_database(db_name)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds))
@@ -0,0 +1,66 @@
+"""Benchmark: login-style bcrypt verification inline on the event loop vs on the PasswordHasher pool.
+
+Fires N concurrent verifications and reports throughput plus event-loop lag
+(how late a 10 ms ticker fires), which is what every other request on the
+worker experiences during a login burst. Needs backend/.env like the app.
+
+    python benchmarks/bench_password_pool.py --logins 64 --workers 4
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+import server  # noqa: E402
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.01) -> list:
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+    return lags
+
+
+async def login_inline(password: str, hashed: str):
+    await asyncio.sleep(0)  # stands in for the users lookup
+    return server.pwd_context.verify_and_update(password, hashed)
+
+
+async def login_pooled(password: str, hashed: str):
+    await asyncio.sleep(0)
+    return await server.password_hasher.verify_and_update(password, hashed)
+
+
+async def run(label: str, login, hashed: str, logins: int):
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[login("SecurePass123!", hashed) for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lags = sorted(await ticker)
+    p95 = lags[max(0, int(len(lags) * 0.95) - 1)] if lags else 0.0
+    print(f"{label:<8} {logins / elapsed:8.1f} logins/s   loop lag p50={statistics.median(lags) if lags else 0:8.1f} ms  p95={p95:8.1f} ms  max={lags[-1] if lags else 0:8.1f} ms")
+
+
+async def main(logins: int, workers: int):
+    server.password_hasher = server.PasswordHasher(workers=workers, max_pending=logins)
+    hashed = server.pwd_context.hash("SecurePass123!")
+    print(f"bcrypt rounds={server.BCRYPT_ROUNDS}, {logins} concurrent logins, pool workers={workers}")
+    await run("inline", login_inline, hashed, logins)
+    await run("pooled", login_pooled, hashed, logins)
+    print(server.password_hasher.metrics())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.workers))
@@ -0,0 +1,98 @@
+"""Benchmark: per-item profile find_one vs batched hydrate_profiles for feeds.
+
+Seeds a scratch database (<DB_NAME>_bench) with feed items and profiles,
+then reports Mongo round trips and p50/p95 latency for feed sizes 20, 100
+and 500. Uses MONGO_URL / DB_NAME / JWT_* from backend/.env.
+
+    python benchmarks/bench_profile_hydration.py --rounds 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+import server  # noqa: E402
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def hydrate_per_item(feed):
+    """The pre-batching implementation, kept here as the baseline"""
+    for item in feed:
+        profile = await server.db.profiles.find_one({"user_id": item['user_id']}, {"_id": 0, "handle": 1, "vibe_identity": 1, "avatar_url": 1})
+        item['profile'] = profile or {}
+    return feed
+
+
+async def seed(db, size: int):
+    await db.profiles.delete_many({})
+    await db.css_snapshots.delete_many({})
+    user_ids = [str(uuid.uuid4()) for _ in range(size)]
+    await db.profiles.insert_many([
+        {"id": str(uuid.uuid4()), "user_id": uid, "handle": f"vibe-{i:04d}", "vibe_identity": "Bench", "avatar_url": None}
+        for i, uid in enumerate(user_ids)
+    ])
+    await db.css_snapshots.insert_many([
+        {"id": str(uuid.uuid4()), "user_id": uid, "color": "#8B9DC3", "light_frequency": 0.5,
+         "sound_texture": "flowing", "emotion_label": "Bench", "description": "", "timestamp": f"2025-01-01T00:{i // 60:02d}:{i % 60:02d}"}
+        for i, uid in enumerate(user_ids)
+    ])
+
+
+async def measure(db, counter: CommandCounter, hydrate, size: int, rounds: int):
+    latencies, trips = [], []
+    for _ in range(rounds):
+        feed = await db.css_snapshots.find({}, {"_id": 0}).sort("timestamp", -1).limit(size).to_list(size)
+        counter.count = 0
+        start = time.perf_counter()
+        await hydrate(feed)
+        latencies.append((time.perf_counter() - start) * 1000)
+        trips.append(counter.count)
+    latencies.sort()
+    return statistics.median(trips), statistics.median(latencies), latencies[max(0, int(len(latencies) * 0.95) - 1)]
+
+
+async def main(rounds: int):
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[counter])
+    db_name = f"{os.environ['DB_NAME']}_bench"
+    server.db = client[db_name]
+    await server.db.profiles.create_index("user_id", unique=True)
+
+    print(f"{'feed size':>9} | {'variant':<10} | {'round trips':>11} | {'p50 ms':>8} | {'p95 ms':>8}")
+    for size in (20, 100, 500):
+        await seed(server.db, size)
+        for label, hydrate in (("per-item", hydrate_per_item), ("batched", server.hydrate_profiles)):
+            trips, p50, p95 = await measure(server.db, counter, hydrate, size, rounds)
+            print(f"{size:>9} | {label:<10} | {trips:>11.0f} | {p50:>8.2f} | {p95:>8.2f}")
+
+    await client.drop_database(db_name)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds))
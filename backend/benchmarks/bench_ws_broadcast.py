@@ -0,0 +1,105 @@
+"""Benchmark: room broadcast to 10k simulated WebSocket connections.
+
+Compares the old sequential send_json loop with ConnectionManager's
+serialize-once, per-connection queue delivery. A share of clients is slow
+(each send sleeps) and a share is dead (each send raises). Reports how long
+the broadcaster is blocked and when the last healthy client has the message.
+Needs backend/.env like the app.
+
+    python benchmarks/bench_ws_broadcast.py --connections 10000 --slow 0.01 --dead 0.005
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+import server  # noqa: E402
+
+
+class FakeSocket:
+    def __init__(self, kind: str, slow_delay: float):
+        self.kind = kind
+        self.slow_delay = slow_delay
+        self.received_at = None
+
+    async def accept(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def _send(self):
+        if self.kind == "dead":
+            raise RuntimeError("socket closed")
+        if self.kind == "slow":
+            await asyncio.sleep(self.slow_delay)
+        self.received_at = time.perf_counter()
+
+    async def send_text(self, payload: str):
+        await self._send()
+
+    async def send_json(self, message: dict):
+        json.dumps(message)
+        await self._send()
+
+
+def make_sockets(n: int, slow: float, dead: float, slow_delay: float):
+    rng = random.Random(42)
+    kinds = ["dead" if r < dead else "slow" if r < dead + slow else "ok" for r in (rng.random() for _ in range(n))]
+    return [FakeSocket(kind, slow_delay) for kind in kinds]
+
+
+MESSAGE = {"type": "new_css", "data": {"id": "x" * 36, "user_id": "y" * 36, "color": "#8B9DC3", "light_frequency": 0.5,
+                                        "sound_texture": "flowing", "emotion_label": "Bench", "description": "z" * 120}}
+
+
+async def sequential(sockets):
+    """The pre-queue ConnectionManager.broadcast loop"""
+    for connection in sockets:
+        try:
+            await connection.send_json(MESSAGE)
+        except:
+            pass
+
+
+def report(label, sockets, start, returned_at):
+    healthy = [s.received_at for s in sockets if s.kind == "ok"]
+    done = max(healthy) if all(healthy) else float("nan")
+    print(f"{label:<10} broadcaster blocked {1000 * (returned_at - start):9.1f} ms   last healthy client {1000 * (done - start):9.1f} ms")
+
+
+async def main(n: int, slow: float, dead: float, slow_delay: float):
+    sockets = make_sockets(n, slow, dead, slow_delay)
+    start = time.perf_counter()
+    await sequential(sockets)
+    report("sequential", sockets, start, time.perf_counter())
+
+    sockets = make_sockets(n, slow, dead, slow_delay)
+    manager = server.ConnectionManager()
+    await manager.start()
+    for socket in sockets:
+        await manager.connect(socket, "bench")
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await manager.broadcast(MESSAGE, "bench")
+    returned_at = time.perf_counter()
+    while any(s.received_at is None for s in sockets if s.kind == "ok"):
+        await asyncio.sleep(0.001)
+    report("queued", sockets, start, returned_at)
+    await asyncio.sleep(0.05)
+    print(f"evicted {manager.stats['evicted']} dead sockets, {len(manager.connections)} remain connected")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--slow", type=float, default=0.01)
+    parser.add_argument("--dead", type=float, default=0.005)
+    parser.add_argument("--slow-delay", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(main(args.connections, args.slow, args.dead, args.slow_delay))
@@ -0,0 +1,120 @@
+"""Load test: /api/ latency while 50 /css/create calls wait on a slow (fake) OpenAI.
+
+Starts a local fake OpenAI server that answers chat completions after a fixed
+delay, points the backend at it through OPENAI_BASE_URL, runs the real app
+under uvicorn and samples GET /api/ before and during the burst.
+
+Uses MONGO_URL / DB_NAME / JWT_* from backend/.env; the throwaway user and its
+snapshots go to a scratch database (<DB_NAME>_bench) that is dropped afterwards.
+
+    python benchmarks/load_llm_gateway.py --delay 3 --burst 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+FAKE_OPENAI_PORT = 8765
+APP_PORT = 8766
+
+
+def build_fake_openai(delay: float) -> Starlette:
+    async def chat_completions(request):
+        await asyncio.sleep(delay)
+        content = '{"color": "#7FB3D5", "light_frequency": 0.42, "sound_texture": "flowing", "emotion_label": "Load Test", "description": "A steady synthetic pulse."}'
+        return JSONResponse({
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()), "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        })
+    return Starlette(routes=[Route("/v1/chat/completions", chat_completions, methods=["POST"])])
+
+
+async def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+async def sample_root(client: httpx.AsyncClient, stop: asyncio.Event, interval: float = 0.05) -> list:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/api/")
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def summarize(label: str, latencies: list):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+    print(f"{label:<28} n={len(latencies):<5} p50={statistics.median(latencies):7.1f} ms  p95={p95:7.1f} ms  max={latencies[-1]:7.1f} ms")
+
+
+async def main(delay: float, burst: int):
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{FAKE_OPENAI_PORT}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-load-test")
+    os.environ.setdefault("OPENAI_MAX_CONCURRENCY", str(burst))
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server as backend
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    db_name = f"{os.environ['DB_NAME']}_bench"
+    backend.db = backend.mongo_client[db_name]
+
+    fake = await serve(build_fake_openai(delay), FAKE_OPENAI_PORT)
+    app = await serve(backend.app, APP_PORT)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", timeout=120) as client:
+        email = f"load_{uuid.uuid4().hex[:8]}@example.com"
+        token = (await client.post("/api/auth/register", json={"email": email, "password": "LoadTest123!"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        stop = asyncio.Event()
+        idle = asyncio.create_task(sample_root(client, stop))
+        await asyncio.sleep(2)
+        stop.set()
+        baseline = await idle
+
+        stop = asyncio.Event()
+        loaded = asyncio.create_task(sample_root(client, stop))
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/api/css/create", json={"emotion_input": f"load test {i}", "language": "en"}, headers=headers)
+            for i in range(burst)
+        ])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        under_load = await loaded
+
+    ok = sum(1 for r in responses if r.status_code == 200)
+    print(f"fake OpenAI delay: {delay}s, burst: {burst} x /css/create ({ok} ok) finished in {elapsed:.1f}s")
+    summarize("GET /api/ idle", baseline)
+    summarize(f"GET /api/ with {burst} in flight", under_load)
+
+    app.should_exit = True
+    fake.should_exit = True
+    await asyncio.sleep(0.2)
+    await backend.mongo_client.drop_database(db_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--delay", type=float, default=3.0)
+    parser.add_argument("--burst", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.delay, args.burst))
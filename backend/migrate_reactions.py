@@ -0,0 +1,73 @@
+"""Collapse duplicate reactions and rebuild reaction_counts, then add the unique reaction index.
+
+The old endpoint inserted one row per tap, so a user could hold several identical reactions on a
+snapshot. The API now enforces one row per (css_id, user_id, reaction_type) with a unique index
+created at startup, which cannot be built while duplicates exist. Run this once before deploying:
+it keeps the oldest row of each duplicate group, recounts every snapshot's counters from the
+remaining rows and creates the index. It is safe to re-run; each run recounts from scratch.
+
+    python migrate_reactions.py [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+REACTION_KEY = {"css_id": "$css_id", "user_id": "$user_id", "reaction_type": "$reaction_type"}
+
+async def remove_duplicates(db, dry_run: bool) -> int:
+    removed = 0
+    duplicates = db.reactions.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": REACTION_KEY, "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    async for group in duplicates:
+        if not dry_run:
+            await db.reactions.delete_many({"_id": {"$in": group['ids'][1:]}})
+        removed += group['n'] - 1
+    return removed
+
+async def rebuild_counts(db) -> int:
+    rebuilt, ops = 0, []
+    async for row in db.reactions.aggregate([
+        {"$group": {"_id": {"css_id": "$css_id", "reaction_type": "$reaction_type"}, "n": {"$sum": 1}}},
+        {"$group": {"_id": "$_id.css_id", "counts": {"$push": {"k": "$_id.reaction_type", "v": "$n"}}, "total": {"$sum": "$n"}}}
+    ], allowDiskUse=True):
+        counts = {entry['k']: entry['v'] for entry in row['counts']}
+        ops.append(UpdateOne({"css_id": row['_id']}, {"$set": {"counts": counts, "total": row['total']}}, upsert=True))
+        if len(ops) >= 1000:
+            await db.reaction_counts.bulk_write(ops, ordered=False)
+            rebuilt, ops = rebuilt + len(ops), []
+    if ops:
+        await db.reaction_counts.bulk_write(ops, ordered=False)
+        rebuilt += len(ops)
+    return rebuilt
+
+async def migrate_reactions(dry_run: bool):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    removed = await remove_duplicates(db, dry_run)
+    if dry_run:
+        print(f"reactions: {removed} duplicate rows would be removed")
+    else:
+        print(f"✅ Removed {removed} duplicate reactions")
+        print(f"✅ Recounted reactions for {await rebuild_counts(db)} snapshots")
+        await db.reactions.create_index([("css_id", 1), ("user_id", 1), ("reaction_type", 1)], unique=True)
+        print("✅ Unique reaction index in place")
+
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="only count the duplicate rows")
+    args = parser.parse_args()
+    asyncio.run(migrate_reactions(args.dry_run))
@@ -0,0 +1,118 @@
+"""Convert ISO-string timestamps to native BSON dates, online and resumably.
+
+Each field is rewritten in batches with bulk_write. Every update is conditional on the old
+string, so the migration can run while the API serves traffic, be interrupted, and be re-run:
+converted rows simply stop matching. Snapshot and timeline timestamps are converted newest
+first, which keeps every remaining string older than every date; the API's keyset pagination
+relies on that while the migration is in progress. Timelines are walked one owner at a time
+along the existing (owner_id, timestamp) index, since they are only ever read per owner.
+
+    python migrate_timestamps.py [--batch-size 1000] [--pause 0.1] [--only css_snapshots users] [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+TIMESTAMP_FIELDS = {
+    "css_snapshots": ["timestamp"],
+    "timelines": ["timestamp"],
+    "users": ["created_at", "premium_expires_at"],
+    "profiles": ["created_at"],
+    "social_graph": ["created_at"],
+    "room_memberships": ["joined_at"],
+    "reactions": ["created_at"],
+    "coach_sessions": ["created_at"],
+    "coach_messages": ["created_at"],
+    "avatar_evolutions": ["created_at"],
+    "vibe_signatures": ["last_css_at", "updated_at"],
+    "ai_results": ["updated_at"],
+}
+
+# Fields read in keyset order: convert newest first so strings never interleave with dates.
+# The value is the field the reads are partitioned by, walked in order so each batch sort is
+# served by that collection's (partition, timestamp) index instead of a collection scan.
+NEWEST_FIRST = {("css_snapshots", "timestamp"): None, ("timelines", "timestamp"): "owner_id"}
+
+def parse_timestamp(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+async def migrate_field(collection, field: str, batch_size: int, pause: float) -> tuple:
+    newest_first = (collection.name, field) in NEWEST_FIRST
+    partition = NEWEST_FIRST.get((collection.name, field))
+    converted, unparseable, last_id, last_key = 0, [], None, None
+    while True:
+        query = {field: {"$type": "string"}}
+        if newest_first:
+            # Converted rows stop matching, so each pass re-reads the newest strings left.
+            # $gte "" only matches strings and bounds the index scan past the converted dates.
+            query[field]["$gte"] = ""
+            if unparseable:
+                query["_id"] = {"$nin": unparseable}
+            if partition and last_key is not None:
+                query[partition] = {"$gte": last_key}
+            sort = ([(partition, 1)] if partition else []) + [(field, -1)]
+        else:
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            sort = [("_id", 1)]
+        projection = {"_id": 1, field: 1, **({partition: 1} if partition else {})}
+        rows = await collection.find(query, projection).sort(sort).limit(batch_size).to_list(batch_size)
+        if not rows:
+            break
+        last_id = rows[-1]["_id"]
+        if partition:
+            last_key = rows[-1].get(partition)
+
+        ops = []
+        for row in rows:
+            try:
+                ops.append(UpdateOne({"_id": row["_id"], field: row[field]}, {"$set": {field: parse_timestamp(row[field])}}))
+            except ValueError:
+                unparseable.append(row["_id"])
+        if ops:
+            result = await collection.bulk_write(ops, ordered=False)
+            converted += result.modified_count
+        print(f"   {collection.name}.{field}: {converted} converted", end="\r", flush=True)
+        await asyncio.sleep(pause)
+    return converted, len(unparseable)
+
+async def migrate_timestamps(batch_size: int, pause: float, only: list, dry_run: bool):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+
+    for name, fields in TIMESTAMP_FIELDS.items():
+        if only and name not in only:
+            continue
+        for field in fields:
+            if dry_run:
+                remaining = await db[name].count_documents({field: {"$type": "string"}})
+                print(f"{name}.{field}: {remaining} string values")
+                continue
+            converted, unparseable = await migrate_field(db[name], field, batch_size, pause)
+            remaining = await db[name].count_documents({field: {"$type": "string"}})
+            note = f", {unparseable} unparseable left as strings" if unparseable else ""
+            if remaining > unparseable:
+                # Rows written as strings during the run (an old API worker); run the tool again
+                note += f", {remaining - unparseable} still to convert"
+            print(f"{'✅' if remaining <= unparseable else '⚠️'} {name}.{field}: converted {converted}{note}")
+
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds to sleep between batches")
+    parser.add_argument("--only", nargs="*", default=[], help="collections to migrate (default: all)")
+    parser.add_argument("--dry-run", action="store_true", help="only count the string values left")
+    args = parser.parse_args()
+    asyncio.run(migrate_timestamps(args.batch_size, args.pause, args.only, args.dry_run))
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, BackgroundTasks, Request, Response, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -17,50 +18,592 @@ import json
 import random
 import string
 import asyncio
+import base64
 import hashlib
+import io
+import math
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import numpy as np
+from PIL import Image, ImageOps
+from bson import Binary
+from pymongo import UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 mongo_url = os.environ['MONGO_URL']
-mongo_client = AsyncIOMotorClient(mongo_url)
+mongo_client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = mongo_client[os.environ['DB_NAME']]
 
-openai_client = openai.OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get('OPENAI_TIMEOUT_SECONDS', 30))
+OPENAI_IMAGE_TIMEOUT_SECONDS = float(os.environ.get('OPENAI_IMAGE_TIMEOUT_SECONDS', 60))
+OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', 16))
+
+CSS_CACHE_ENABLED = os.environ.get('CSS_CACHE_ENABLED', 'true').lower() == 'true'
+CSS_CACHE_MONGO = os.environ.get('CSS_CACHE_MONGO', 'false').lower() == 'true'
+CSS_CACHE_TTL_SECONDS = int(os.environ.get('CSS_CACHE_TTL_SECONDS', 6 * 3600))
+CSS_CACHE_MAX_ENTRIES = int(os.environ.get('CSS_CACHE_MAX_ENTRIES', 5000))
+CSS_CACHE_REFRESH_RATE = float(os.environ.get('CSS_CACHE_REFRESH_RATE', 0.1))
+
+VIBE_RADAR_MIN_SIMILARITY = float(os.environ.get('VIBE_RADAR_MIN_SIMILARITY', 0.7))
+VIBE_SIGNATURE_ALPHA = float(os.environ.get('VIBE_SIGNATURE_ALPHA', 0.3))
+VIBE_SIGNATURE_HALF_LIFE_HOURS = float(os.environ.get('VIBE_SIGNATURE_HALF_LIFE_HOURS', 72))
+VIBE_INDEX_REFRESH_SECONDS = int(os.environ.get('VIBE_INDEX_REFRESH_SECONDS', 30))
+VIBE_INDEX_SYNC_OVERLAP_SECONDS = float(os.environ.get('VIBE_INDEX_SYNC_OVERLAP_SECONDS', 60))
+
+EMPATHY_MIN_SNAPSHOTS = 3
+EMPATHY_MIN_SCORE = float(os.environ.get('EMPATHY_MIN_SCORE', 0.15))
+EMPATHY_TERM_DECAY = float(os.environ.get('EMPATHY_TERM_DECAY', 0.85))
+EMPATHY_POSTINGS_PER_TERM = int(os.environ.get('EMPATHY_POSTINGS_PER_TERM', 2000))
+
+openai_client = openai.AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 JWT_SECRET = os.environ['JWT_SECRET']
 JWT_ALGORITHM = os.environ['JWT_ALGORITHM']
 JWT_EXPIRATION_HOURS = int(os.environ.get('JWT_EXPIRATION_HOURS', 168))
+JWT_TRUST_CLAIMS = os.environ.get('JWT_TRUST_CLAIMS', 'false').lower() == 'true'
+
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 20000))
+
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.environ.get('TIMELINE_FANOUT_MAX_FOLLOWERS', 5000))
+TIMELINE_TTL_DAYS = int(os.environ.get('TIMELINE_TTL_DAYS', 30))
+TIMELINE_BACKFILL_ITEMS = int(os.environ.get('TIMELINE_BACKFILL_ITEMS', 50))
+TIMELINE_FALLBACK_MAX_FOLLOWS = int(os.environ.get('TIMELINE_FALLBACK_MAX_FOLLOWS', 500))
+
+GLOBAL_FEED_BUFFER_SIZE = int(os.environ.get('GLOBAL_FEED_BUFFER_SIZE', 200))
+GLOBAL_FEED_SYNC_SECONDS = float(os.environ.get('GLOBAL_FEED_SYNC_SECONDS', 5))
+GLOBAL_FEED_SYNC_OVERLAP_SECONDS = float(os.environ.get('GLOBAL_FEED_SYNC_OVERLAP_SECONDS', 30))
+
+COACH_CONTEXT_MESSAGES = int(os.environ.get('COACH_CONTEXT_MESSAGES', 20))
+COACH_VERBATIM_MESSAGES = int(os.environ.get('COACH_VERBATIM_MESSAGES', 8))
+COACH_SUMMARY_BATCH = int(os.environ.get('COACH_SUMMARY_BATCH', 8))
+COACH_SUMMARY_MAX_TOKENS = int(os.environ.get('COACH_SUMMARY_MAX_TOKENS', 200))
+COACH_PROMPT_TOKEN_BUDGET = int(os.environ.get('COACH_PROMPT_TOKEN_BUDGET', 2000))
+
+AI_RESULTS_PRECOMPUTE = os.environ.get('AI_RESULTS_PRECOMPUTE', 'false').lower() == 'true'
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 4))
+JOB_BACKOFF_BASE_SECONDS = float(os.environ.get('JOB_BACKOFF_BASE_SECONDS', 2))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 180))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 2))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+AVATAR_STORE = os.environ.get('AVATAR_STORE', 'local')  # local | s3
+AVATAR_STORE_DIR = Path(os.environ.get('AVATAR_STORE_DIR', ROOT_DIR / 'media' / 'avatars'))
+AVATAR_S3_BUCKET = os.environ.get('AVATAR_S3_BUCKET', '')
+AVATAR_PUBLIC_BASE_URL = os.environ.get('AVATAR_PUBLIC_BASE_URL', '/api/media/avatars')
+AVATAR_VARIANT_SIZES = [int(size) for size in os.environ.get('AVATAR_VARIANT_SIZES', '64,128,256').split(',')]
+AVATAR_FEED_SIZE = int(os.environ.get('AVATAR_FEED_SIZE', 128))
+AVATAR_MAX_SOURCE_BYTES = int(os.environ.get('AVATAR_MAX_SOURCE_BYTES', 20 * 1024 * 1024))
+
+ROOM_DYNAMICS_WINDOW_HOURS = float(os.environ.get('ROOM_DYNAMICS_WINDOW_HOURS', 168))
+ROOM_DYNAMICS_TTL_SECONDS = float(os.environ.get('ROOM_DYNAMICS_TTL_SECONDS', 60))
+ROOM_CATALOG_SYNC_SECONDS = float(os.environ.get('ROOM_CATALOG_SYNC_SECONDS', 30))
+TRENDING_BUCKET_MINUTES = int(os.environ.get('TRENDING_BUCKET_MINUTES', 15))
+TRENDING_WINDOW_HOURS = float(os.environ.get('TRENDING_WINDOW_HOURS', 24))
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 3))
+TRENDING_RECOMPUTE_SECONDS = float(os.environ.get('TRENDING_RECOMPUTE_SECONDS', 60))
+
+WS_BROKER = os.environ.get('WS_BROKER', 'memory')
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', 64))
+WS_SEND_TIMEOUT_SECONDS = float(os.environ.get('WS_SEND_TIMEOUT_SECONDS', 10))
+WS_SLOW_CONSUMER_POLICY = os.environ.get('WS_SLOW_CONSUMER_POLICY', 'drop_oldest')  # drop_oldest | drop_newest | disconnect
+WS_EVENTS_TTL_SECONDS = int(os.environ.get('WS_EVENTS_TTL_SECONDS', 300))
 
 security = HTTPBearer()
 app = FastAPI(title="CogitoSync v3.0")
 api_router = APIRouter(prefix="/api")
 
+# WebSocket Brokers
+class InMemoryBroker:
+    """Single-process broker: a publish is delivered straight to this worker's sockets"""
+    async def start(self, deliver):
+        self.deliver = deliver
+    
+    async def publish(self, room_id: str, message: dict):
+        await self.deliver(room_id, message)
+    
+    async def stop(self):
+        pass
+
+class MongoChangeStreamBroker:
+    """Multi-process broker: publishes are written to ws_events and every worker tails them
+    through a change stream, delivering only to its own sockets (requires a replica set)"""
+    def __init__(self):
+        self.origin = str(uuid.uuid4())
+        self.resume_token = None
+        self.task: Optional[asyncio.Task] = None
+    
+    async def start(self, deliver):
+        self.deliver = deliver
+        self.task = asyncio.create_task(self._listen())
+    
+    async def publish(self, room_id: str, message: dict):
+        # Local sockets get the message immediately; other workers pick it up from the stream
+        await self.deliver(room_id, message)
+        await db.ws_events.insert_one({
+            "origin": self.origin, "room_id": room_id, "message": message, "created_at": datetime.now(timezone.utc)
+        })
+    
+    async def _listen(self):
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": self.origin}}}]
+        while True:
+            try:
+                async with db.ws_events.watch(pipeline, resume_after=self.resume_token) as stream:
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        event = change['fullDocument']
+                        await self.deliver(event['room_id'], event['message'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"WebSocket broker stream error: {e}")
+                await asyncio.sleep(1)
+    
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+def make_broker():
+    return MongoChangeStreamBroker() if WS_BROKER == 'mongo' else InMemoryBroker()
+
 # WebSocket Manager
+USER_CHANNEL_PREFIX = "user:"
+
+class Connection:
+    """One socket with its own bounded outbound queue, drained by a dedicated writer task"""
+    def __init__(self, websocket: WebSocket, user_id: Optional[str] = None, queue_size: int = WS_SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.rooms: set = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+    
+    def enqueue(self, payload: str) -> bool:
+        """Queue an already serialized message; returns False if the consumer should be evicted"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if WS_SLOW_CONSUMER_POLICY == 'disconnect':
+                return False
+            if WS_SLOW_CONSUMER_POLICY == 'drop_oldest':
+                # Live updates are only useful while fresh: discard the stalest pending one
+                self.queue.get_nowait()
+                self.queue.put_nowait(payload)
+            return True
+    
+    def send(self, message: dict) -> bool:
+        return self.enqueue(json.dumps(message, default=json_default))
+    
+    async def run_writer(self, on_failure):
+        try:
+            while True:
+                payload = await self.queue.get()
+                async with asyncio.timeout(WS_SEND_TIMEOUT_SECONDS):
+                    await self.websocket.send_text(payload)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            await on_failure(self)
+    
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    """Registry of this worker's sockets, indexed by room, by user and by socket"""
+    def __init__(self, broker=None):
+        self.active_connections: Dict[str, set] = {}
+        self.user_connections: Dict[str, set] = {}
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.broker = broker or InMemoryBroker()
+        self.stats = {"delivered": 0, "dropped": 0, "evicted": 0}
+    
+    async def start(self):
+        await self.broker.start(self.deliver)
     
-    async def connect(self, websocket: WebSocket, room_id: str = "global"):
+    async def connect(self, websocket: WebSocket, room_id: str = "global", user_id: Optional[str] = None) -> Connection:
         await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append(websocket)
+        connection = Connection(websocket, user_id)
+        connection.writer = asyncio.create_task(connection.run_writer(self.evict))
+        self.connections[websocket] = connection
+        if user_id:
+            self.user_connections.setdefault(user_id, set()).add(connection)
+        self.join(connection, room_id)
+        return connection
     
-    def disconnect(self, websocket: WebSocket, room_id: str = "global"):
-        if room_id in self.active_connections and websocket in self.active_connections[room_id]:
-            self.active_connections[room_id].remove(websocket)
+    def join(self, connection: Connection, room_id: str):
+        connection.rooms.add(room_id)
+        self.active_connections.setdefault(room_id, set()).add(connection)
+    
+    def leave(self, connection: Connection, room_id: str):
+        connection.rooms.discard(room_id)
+        members = self.active_connections.get(room_id)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self.active_connections[room_id]
+    
+    def disconnect(self, websocket: WebSocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        # Closing is left to Connection.close(); a writer evicting itself must not cancel itself
+        if connection.writer and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        for room_id in list(connection.rooms):
+            self.leave(connection, room_id)
+        if connection.user_id:
+            sockets = self.user_connections.get(connection.user_id)
+            if sockets is not None:
+                sockets.discard(connection)
+                if not sockets:
+                    del self.user_connections[connection.user_id]
+    
+    async def evict(self, connection: Connection):
+        """Drop a socket whose writes fail or time out so it stops costing every broadcast"""
+        self.stats["evicted"] += 1
+        self.disconnect(connection.websocket)
+        await connection.close()
+    
+    def room_occupancy(self, room_id: str) -> int:
+        return len(self.active_connections.get(room_id, ()))
+    
+    def is_online(self, user_id: str) -> bool:
+        return bool(self.user_connections.get(user_id))
     
     async def broadcast(self, message: dict, room_id: str = "global"):
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
+        """Publish to every worker; each one delivers to the sockets it owns"""
+        await self.broker.publish(room_id, message)
+    
+    async def send_to_user(self, user_id: str, message: dict):
+        await self.broker.publish(f"{USER_CHANNEL_PREFIX}{user_id}", message)
+    
+    async def deliver(self, channel: str, message: dict):
+        if channel.startswith(USER_CHANNEL_PREFIX):
+            connections = self.user_connections.get(channel[len(USER_CHANNEL_PREFIX):])
+        else:
+            connections = self.active_connections.get(channel)
+        if not connections:
+            return
+        # Serialize once; every socket gets the same bytes through its own queue
+        payload = json.dumps(message, default=json_default)
+        slow = []
+        for connection in connections:
+            dropped = connection.dropped
+            if not connection.enqueue(payload):
+                slow.append(connection)
+            self.stats["dropped"] += connection.dropped - dropped
+        self.stats["delivered"] += len(connections) - len(slow)
+        for connection in slow:
+            await self.evict(connection)
+
+manager = ConnectionManager(make_broker())
+
+# LLM Gateway
+class LLMGateway:
+    """Awaitable access to OpenAI with a per-call timeout and bounded concurrency"""
+    def __init__(self, client: openai.AsyncOpenAI, max_concurrency: int = OPENAI_MAX_CONCURRENCY, timeout: float = OPENAI_TIMEOUT_SECONDS):
+        self.client = client
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+    
+    async def _call(self, factory, timeout: float):
+        # The timeout covers the wait for a free slot as well as the request itself
+        async def run():
+            async with self.semaphore:
+                self.in_flight += 1
                 try:
-                    await connection.send_json(message)
-                except:
-                    pass
+                    return await factory()
+                finally:
+                    self.in_flight -= 1
+        return await asyncio.wait_for(run(), timeout)
+    
+    async def chat(self, messages: List[dict], model: str = "gpt-4o", timeout: Optional[float] = None, **kwargs) -> str:
+        timeout = timeout or self.timeout
+        response = await self._call(
+            lambda: self.client.chat.completions.create(model=model, messages=messages, timeout=timeout, **kwargs),
+            timeout
+        )
+        return response.choices[0].message.content
+    
+    async def chat_stream(self, messages: List[dict], model: str = "gpt-4o", timeout: Optional[float] = None, **kwargs):
+        """Yield reply text as it arrives; the slot is held until the stream ends"""
+        timeout = timeout or self.timeout
+        await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        self.in_flight += 1
+        try:
+            # The SDK timeout bounds each read, so a stalled stream fails instead of hanging
+            stream = await self.client.chat.completions.create(model=model, messages=messages, timeout=timeout, stream=True, **kwargs)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+    
+    async def generate_image(self, prompt: str, timeout: Optional[float] = None, **kwargs) -> str:
+        timeout = timeout or OPENAI_IMAGE_TIMEOUT_SECONDS
+        response = await self._call(
+            lambda: self.client.images.generate(model="dall-e-3", prompt=prompt, n=1, timeout=timeout, **kwargs),
+            timeout
+        )
+        return response.data[0].url
+
+llm = LLMGateway(openai_client)
 
-manager = ConnectionManager()
+# CSS Generation Cache
+CSS_CACHE_FILLER_WORDS = {
+    "so", "very", "really", "just", "quite", "pretty", "kinda", "a", "bit", "little", "feeling", "feel", "i", "im", "am",
+    "çok", "cok", "biraz", "gerçekten", "aşırı", "hissediyorum", "ben", "bir", "sanki"
+}
+
+def normalize_emotion_input(text: str) -> str:
+    """Reduce near-duplicate inputs ("Tired.", "so tired") to one cache key text"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    # Drop apostrophes so contractions stay one word ("i'm" -> "im") instead of splitting into "i" and "m"
+    words = re.findall(r"\w+", re.sub(r"['’ʼ]", "", text))
+    meaningful = [w for w in words if w not in CSS_CACHE_FILLER_WORDS]
+    return " ".join(meaningful or words)
+
+class CSSGenerationCache:
+    """LRU + TTL cache for AI generated CSS, with an optional Mongo-backed second tier"""
+    def __init__(self, max_entries: int = CSS_CACHE_MAX_ENTRIES, ttl_seconds: int = CSS_CACHE_TTL_SECONDS,
+                 refresh_rate: float = CSS_CACHE_REFRESH_RATE, use_mongo: bool = CSS_CACHE_MONGO, enabled: bool = CSS_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.refresh_rate = refresh_rate
+        self.use_mongo = use_mongo
+        self.enabled = enabled
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "mongo_hits": 0, "misses": 0, "refreshes": 0, "bypassed": 0}
+    
+    @staticmethod
+    def make_key(emotion_input: str, language: str) -> str:
+        normalized = normalize_emotion_input(emotion_input)
+        return hashlib.sha1(f"{language}:{normalized}".encode()).hexdigest()
+    
+    def _get_local(self, key: str) -> Optional[dict]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+    
+    def _set_local(self, key: str, value: dict):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    async def get(self, key: str) -> Optional[dict]:
+        value = self._get_local(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+        if self.use_mongo:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+            doc = await db.css_generation_cache.find_one({"key": key, "created_at": {"$gte": cutoff}}, {"_id": 0, "value": 1})
+            if doc:
+                self.stats["mongo_hits"] += 1
+                self._set_local(key, doc["value"])
+                return doc["value"]
+        self.stats["misses"] += 1
+        return None
+    
+    async def set(self, key: str, value: dict):
+        self._set_local(key, value)
+        if self.use_mongo:
+            await db.css_generation_cache.update_one(
+                {"key": key},
+                {"$set": {"value": value, "created_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+    
+    async def generate(self, emotion_input: str, language: str, bypass: bool = False) -> dict:
+        if not self.enabled or bypass:
+            self.stats["bypassed"] += 1
+            return await generate_css_with_ai(emotion_input, language)
+        
+        key = self.make_key(emotion_input, language)
+        cached = await self.get(key)
+        # Let a small share of hits regenerate so repeated moods don't always look identical
+        if cached is not None and random.random() >= self.refresh_rate:
+            return dict(cached)
+        if cached is not None:
+            self.stats["refreshes"] += 1
+        
+        result = await generate_css_with_ai(emotion_input, language)
+        if result.get("error") != "fallback":
+            await self.set(key, result)
+        return result
+    
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["mongo_hits"] + self.stats["misses"]
+        hit_ratio = (self.stats["hits"] + self.stats["mongo_hits"]) / lookups if lookups else 0.0
+        return {**self.stats, "hit_ratio": round(hit_ratio, 3), "size": len(self.entries), "enabled": self.enabled}
+
+css_cache = CSSGenerationCache()
+
+# User Principal Cache
+class UserPrincipalCache:
+    """Short-lived cache of authenticated users so get_current_user can skip db.users"""
+    def __init__(self, ttl_seconds: float = USER_CACHE_TTL_SECONDS, max_entries: int = USER_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "claims_trusted": 0, "invalidations": 0}
+        self.served_age_total = 0.0
+        self.served_age_max = 0.0
+    
+    def get(self, user_id: str) -> Optional[dict]:
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age <= self.ttl_seconds:
+                self.entries.move_to_end(user_id)
+                self.stats["hits"] += 1
+                self.served_age_total += age
+                self.served_age_max = max(self.served_age_max, age)
+                return dict(entry[1])
+            del self.entries[user_id]
+        self.stats["misses"] += 1
+        return None
+    
+    def set(self, user: dict):
+        self.entries[user['id']] = (time.monotonic(), user)
+        self.entries.move_to_end(user['id'])
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def invalidate(self, user_id: str):
+        if self.entries.pop(user_id, None) is not None:
+            self.stats["invalidations"] += 1
+    
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "avg_served_age_seconds": round(self.served_age_total / self.stats["hits"], 3) if self.stats["hits"] else 0.0,
+            "max_served_age_seconds": round(self.served_age_max, 3),
+            "size": len(self.entries),
+            "trust_claims": JWT_TRUST_CLAIMS
+        }
+
+user_cache = UserPrincipalCache()
+
+# Password Hashing Pool
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool (bcrypt releases the GIL) instead of the event loop"""
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.stats = {"completed": 0, "rejected": 0, "rehashed": 0, "wait_ms_total": 0.0, "run_ms_total": 0.0}
+    
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+        self.pending += 1
+        queued_at = time.perf_counter()
+        
+        def timed():
+            started_at = time.perf_counter()
+            result = fn(*args)
+            return result, started_at
+        
+        try:
+            result, started_at = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.pending -= 1
+        finished_at = time.perf_counter()
+        self.stats["completed"] += 1
+        self.stats["wait_ms_total"] += (started_at - queued_at) * 1000
+        self.stats["run_ms_total"] += (finished_at - started_at) * 1000
+        return result
+    
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+    
+    async def verify_and_update(self, password: str, hashed: str) -> tuple:
+        """Returns (valid, new_hash); new_hash is set when the stored hash uses outdated parameters"""
+        valid, new_hash = await self._run(pwd_context.verify_and_update, password, hashed)
+        if new_hash:
+            self.stats["rehashed"] += 1
+        return valid, new_hash
+    
+    def metrics(self) -> dict:
+        completed = self.stats["completed"] or 1
+        return {
+            "pending": self.pending, "max_pending": self.max_pending, "workers": self.executor._max_workers,
+            "completed": self.stats["completed"], "rejected": self.stats["rejected"], "rehashed": self.stats["rehashed"],
+            "avg_wait_ms": round(self.stats["wait_ms_total"] / completed, 2),
+            "avg_run_ms": round(self.stats["run_ms_total"] / completed, 2)
+        }
+
+password_hasher = PasswordHasher()
+
+# Timestamps
+def utc_now() -> datetime:
+    """Current UTC time at the millisecond precision BSON dates store, so in-memory copies match the database"""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def as_utc(value) -> Optional[datetime]:
+    """A stored timestamp as an aware UTC datetime, whether native or a legacy ISO string"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def json_default(value):
+    """json.dumps hook: datetimes go out as ISO strings, the API's wire format"""
+    if isinstance(value, datetime):
+        return as_utc(value).isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def time_range(field: str, gte: Optional[datetime] = None, lt: Optional[datetime] = None) -> dict:
+    """Range filter on a timestamp field that also matches rows migrate_timestamps.py has not converted yet"""
+    native, legacy = {}, {}
+    if gte:
+        native["$gte"], legacy["$gte"] = gte, gte.isoformat()
+    if lt:
+        native["$lt"], legacy["$lt"] = lt, lt.isoformat()
+    return {"$or": [{field: native}, {field: legacy}]}
 
 # Models
 class User(BaseModel):
@@ -70,7 +613,7 @@ class User(BaseModel):
     password_hash: str
     is_premium: bool = False
     premium_expires_at: Optional[datetime] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=utc_now)
 
 class UserRegister(BaseModel):
     email: EmailStr
@@ -98,12 +641,13 @@ class CSS(BaseModel):
     description: str
     image_url: Optional[str] = None
     location_hash: Optional[str] = None
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    timestamp: datetime = Field(default_factory=utc_now)
 
 class CSSCreate(BaseModel):
     emotion_input: str
     location: Optional[Dict[str, float]] = None
     language: Optional[str] = 'tr'
+    bypass_cache: bool = False
 
 class ProfileCreate(BaseModel):
     vibe_identity: str
@@ -123,11 +667,15 @@ class Reaction(BaseModel):
     reaction_type: str  # wave, pulse, spiral, color-shift
 
 # Utilities
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def user_claims(user: dict) -> dict:
+    """Claims embedded in access tokens; enough to act as the principal when JWT_TRUST_CLAIMS is on"""
+    expires_at = user.get('premium_expires_at')
+    if isinstance(expires_at, datetime):
+        expires_at = as_utc(expires_at).isoformat()
+    return {"user_id": user['id'], "email": user['email'], "is_premium": user.get('is_premium', False), "premium_expires_at": expires_at}
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -142,9 +690,15 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id: str = payload.get("user_id")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        if JWT_TRUST_CLAIMS and "is_premium" in payload:
+            user_cache.stats["claims_trusted"] += 1
+            return {"id": user_id, "email": payload.get("email"), "is_premium": payload["is_premium"], "premium_expires_at": payload.get("premium_expires_at")}
+        user = user_cache.get(user_id)
         if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
+            user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+            if user is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache.set(user)
         return user
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -159,6 +713,1212 @@ def hash_location(lat: float, lon: float, precision: int = 3) -> str:
     rounded_lon = round(lon, precision)
     return hashlib.md5(f"{rounded_lat}:{rounded_lon}".encode()).hexdigest()[:8]
 
+# Keyset Pagination
+MAX_PAGE_SIZE = 100
+KEYSET_SORT = [("timestamp", -1), ("id", -1)]
+
+def encode_cursor(item: dict) -> str:
+    timestamp = item['timestamp']
+    # Native dates are marked so the cursor compares against the same BSON type it was cut from
+    key = [as_utc(timestamp).isoformat(), item['id'], "d"] if isinstance(timestamp, datetime) else [timestamp, item['id']]
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        timestamp, item_id = key[0], key[1]
+        if len(key) > 2:
+            timestamp = datetime.fromisoformat(timestamp)
+        return timestamp, item_id
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+def keyset_query(query: dict, cursor: Optional[str] = None, since: Optional[str] = None) -> dict:
+    """Restrict a (timestamp, id) ordered query to items older than cursor and/or newer than since"""
+    clauses = [query] if query else []
+    # Rows still holding ISO strings are older than every native date (migrate_timestamps.py converts newest first)
+    if cursor:
+        timestamp, item_id = decode_cursor(cursor)
+        older = [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "id": {"$lt": item_id}}]
+        if isinstance(timestamp, datetime):
+            older.append({"timestamp": {"$type": "string"}})
+        clauses.append({"$or": older})
+    if since:
+        timestamp, item_id = decode_cursor(since)
+        newer = [{"timestamp": {"$gt": timestamp}}, {"timestamp": timestamp, "id": {"$gt": item_id}}]
+        if not isinstance(timestamp, datetime):
+            newer.append({"timestamp": {"$type": "date"}})
+        clauses.append({"$or": newer})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def page_cursors(items: List[dict], limit: int, since: Optional[str] = None) -> dict:
+    """next_cursor pages further back; since_cursor fetches only what is newer on the next refresh"""
+    return {
+        "next_cursor": encode_cursor(items[-1]) if len(items) == limit else None,
+        "since_cursor": encode_cursor(items[0]) if items else since
+    }
+
+async def fetch_page(query: dict, limit: int, cursor: Optional[str] = None, since: Optional[str] = None,
+                     collection=None, projection: Optional[dict] = None) -> List[dict]:
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    collection = collection if collection is not None else db.css_snapshots
+    return await collection.find(keyset_query(query, cursor, since), projection or {"_id": 0}).sort(KEYSET_SORT).limit(limit).to_list(limit)
+
+# Home Timelines
+class HomeTimelines:
+    """Materialized per-user feeds: create_css copies each snapshot into its followers' timelines.
+
+    Authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers are not fanned out; their
+    posts are merged in at read time. Entries expire after TIMELINE_TTL_DAYS, and pages beyond
+    the materialized window fall back to reading the followed users' snapshots directly, only
+    older than the oldest entry read and over at most TIMELINE_FALLBACK_MAX_FOLLOWS follows.
+    """
+    PROJECTION = {"_id": 0, "owner_id": 0, "created_at": 0}
+    
+    def __init__(self):
+        self.high_fanout: List[str] = []
+        self.high_fanout_loaded_at = 0.0
+    
+    @staticmethod
+    def _entry(owner_id: str, css: dict) -> dict:
+        return {**{k: v for k, v in css.items() if k != '_id'}, "owner_id": owner_id, "created_at": datetime.now(timezone.utc)}
+    
+    async def high_fanout_authors(self) -> List[str]:
+        if time.monotonic() - self.high_fanout_loaded_at > 60:
+            authors = await db.profiles.find({"followers_count": {"$gt": TIMELINE_FANOUT_MAX_FOLLOWERS}}, {"_id": 0, "user_id": 1}).to_list(None)
+            self.high_fanout = [a['user_id'] for a in authors]
+            self.high_fanout_loaded_at = time.monotonic()
+        return self.high_fanout
+    
+    async def fan_out(self, css: dict):
+        author = await db.profiles.find_one({"user_id": css['user_id']}, {"_id": 0, "followers_count": 1})
+        if author and author.get('followers_count', 0) > TIMELINE_FANOUT_MAX_FOLLOWERS:
+            return
+        batch = []
+        async for edge in db.social_graph.find({"following_id": css['user_id']}, {"_id": 0, "follower_id": 1}):
+            batch.append(self._entry(edge['follower_id'], css))
+            if len(batch) == 1000:
+                await self._insert(batch)
+                batch = []
+        if batch:
+            await self._insert(batch)
+    
+    @staticmethod
+    async def _insert(entries: List[dict]):
+        try:
+            await db.timelines.insert_many(entries, ordered=False)
+        except BulkWriteError:
+            pass  # entry already present from a follow backfill
+    
+    async def on_follow(self, follower_id: str, target_user_id: str):
+        """Seed the follower's timeline with the new followee's recent posts"""
+        if target_user_id in await self.high_fanout_authors():
+            return
+        recent = await db.css_snapshots.find({"user_id": target_user_id}, {"_id": 0}).sort(KEYSET_SORT).limit(TIMELINE_BACKFILL_ITEMS).to_list(TIMELINE_BACKFILL_ITEMS)
+        if recent:
+            await db.timelines.bulk_write([
+                UpdateOne({"owner_id": follower_id, "id": css['id']}, {"$setOnInsert": self._entry(follower_id, css)}, upsert=True)
+                for css in recent
+            ], ordered=False)
+    
+    async def on_unfollow(self, follower_id: str, target_user_id: str):
+        await db.timelines.delete_many({"owner_id": follower_id, "user_id": target_user_id})
+    
+    async def read(self, owner_id: str, limit: int, cursor: Optional[str] = None, since: Optional[str] = None) -> List[dict]:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        pages = [await fetch_page({"owner_id": owner_id}, limit, cursor, since, db.timelines, self.PROJECTION)]
+        
+        high_fanout = await self.high_fanout_authors()
+        if high_fanout:
+            followed = await db.social_graph.find(
+                {"follower_id": owner_id, "following_id": {"$in": high_fanout}}, {"_id": 0, "following_id": 1}
+            ).to_list(len(high_fanout))
+            if followed:
+                pages.append(await fetch_page({"user_id": {"$in": [f['following_id'] for f in followed]}}, limit, cursor, since))
+        
+        if len(pages[0]) < limit and not since:
+            # Past the materialized window (or follows made before timelines existed): read directly.
+            # The timeline ran out, so only what is older than its last entry can be missing; the
+            # follow cap keeps this bounded for sparse timelines, which come up short on every read.
+            following = await db.social_graph.find(
+                {"follower_id": owner_id}, {"_id": 0, "following_id": 1}
+            ).limit(TIMELINE_FALLBACK_MAX_FOLLOWS).to_list(TIMELINE_FALLBACK_MAX_FOLLOWS)
+            older_than = encode_cursor(pages[0][-1]) if pages[0] else cursor
+            pages.append(await fetch_page({"user_id": {"$in": [f['following_id'] for f in following]}}, limit, older_than))
+        
+        merged = {item['id']: item for page in pages for item in page}
+        return sorted(merged.values(), key=lambda item: (as_utc(item['timestamp']), item['id']), reverse=True)[:limit]
+
+timelines = HomeTimelines()
+
+# Profile Hydration
+FEED_PROFILE_FIELDS = ["handle", "vibe_identity", "avatar_url"]
+
+async def fetch_profiles(user_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, dict]:
+    """Load the profiles of many users in a single $in query, keyed by user_id"""
+    unique_ids = list(dict.fromkeys(user_ids))
+    if not unique_ids:
+        return {}
+    projection = {"_id": 0}
+    if fields:
+        projection.update({"user_id": 1, **{field: 1 for field in fields}})
+    profiles = await db.profiles.find({"user_id": {"$in": unique_ids}}, projection).to_list(len(unique_ids))
+    if fields:
+        return {p['user_id']: {k: v for k, v in p.items() if k in fields} for p in profiles}
+    return {p['user_id']: p for p in profiles}
+
+async def hydrate_profiles(items: List[dict], fields: Optional[List[str]] = FEED_PROFILE_FIELDS) -> List[dict]:
+    """Embed each item's author profile under item['profile'] with one round trip"""
+    profiles = await fetch_profiles([item['user_id'] for item in items], fields)
+    for item in items:
+        item['profile'] = profiles.get(item['user_id'], {})
+    return items
+
+# Reaction Counters
+REACTION_TYPE_PATTERN = re.compile(r"^[a-z][a-z0-9_-]{0,31}$")
+
+class ReactionCounters:
+    """One reaction_counts document per snapshot holding {reaction_type: n}, kept current with $inc.
+
+    reactions holds at most one row per (css_id, user_id, reaction_type), enforced by a unique
+    index, so reacting twice toggles the reaction off instead of inflating the count.
+    """
+    async def toggle(self, css_id: str, user_id: str, reaction_type: str) -> bool:
+        """Add the reaction, or remove it if already present; True when it is now on"""
+        key = {"css_id": css_id, "user_id": user_id, "reaction_type": reaction_type}
+        # Delete-then-upsert toggles correctly even on rows from before the unique index existed
+        if await db.reactions.find_one_and_delete(key, projection={"_id": 1}):
+            delta = -1
+        else:
+            try:
+                result = await db.reactions.update_one(
+                    key, {"$setOnInsert": {"id": str(uuid.uuid4()), "created_at": utc_now()}}, upsert=True
+                )
+            except DuplicateKeyError:
+                result = None
+            if not (result and result.upserted_id):
+                # A concurrent tap added it first and already incremented
+                return True
+            delta = 1
+        await db.reaction_counts.update_one(
+            {"css_id": css_id}, {"$inc": {f"counts.{reaction_type}": delta, "total": delta}}, upsert=True
+        )
+        return delta > 0
+    
+    async def counts(self, css_ids: List[str]) -> Dict[str, dict]:
+        """Non-zero counts for many snapshots in a single $in query, keyed by css_id"""
+        unique_ids = list(dict.fromkeys(css_ids))
+        if not unique_ids:
+            return {}
+        docs = await db.reaction_counts.find({"css_id": {"$in": unique_ids}}, {"_id": 0, "css_id": 1, "counts": 1}).to_list(len(unique_ids))
+        return {d['css_id']: {k: v for k, v in (d.get('counts') or {}).items() if v > 0} for d in docs}
+    
+    async def hydrate(self, items: List[dict]) -> List[dict]:
+        counts = await self.counts([item['id'] for item in items])
+        for item in items:
+            item['reaction_counts'] = counts.get(item['id'], {})
+        return items
+
+reactions = ReactionCounters()
+
+async def hydrate_feed(items: List[dict]) -> List[dict]:
+    """Author profile and reaction counts for feed items: two queries per page, whatever its size"""
+    await asyncio.gather(hydrate_profiles(items), reactions.hydrate(items))
+    return items
+
+# Vibe Signatures
+VIBE_FREQ_CENTERS = np.linspace(0.0, 1.0, 6)
+VIBE_HUE_BINS = 8
+VIBE_TEXTURE_DIM = 8
+VIBE_EMOTION_DIM = 16
+VIBE_DIM = len(VIBE_FREQ_CENTERS) + VIBE_HUE_BINS + 2 + VIBE_TEXTURE_DIM + VIBE_EMOTION_DIM
+
+def hex_to_lab(color: str) -> tuple:
+    """Convert a #RRGGBB color to CIELAB (D65)"""
+    color = (color or "").lstrip('#')
+    try:
+        rgb = [int(color[i:i + 2], 16) / 255 for i in (0, 2, 4)]
+    except ValueError:
+        rgb = [0.5, 0.5, 0.5]
+    r, g, b = [c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4 for c in rgb]
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+    fx, fy, fz = [t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116 for t in (x, y, z)]
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+def hashed_embedding(text: str, dim: int) -> np.ndarray:
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in re.findall(r"\w+", unicodedata.normalize("NFKC", text or "").casefold()):
+        vector[int(hashlib.md5(token.encode()).hexdigest(), 16) % dim] += 1.0
+    return vector
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def vibe_features(css: dict) -> np.ndarray:
+    """Feature vector of a single snapshot: frequency, Lab hue histogram, texture and emotion"""
+    freq = float(css.get('light_frequency', 0.5) or 0.5)
+    freq_block = np.exp(-((freq - VIBE_FREQ_CENTERS) ** 2) / (2 * 0.15 ** 2))
+    
+    lightness, a, b = hex_to_lab(css.get('color', '#8B9DC3'))
+    chroma_weight = min(math.hypot(a, b) / 100, 1.0)
+    hue_position = (math.atan2(b, a) % (2 * math.pi)) / (2 * math.pi) * VIBE_HUE_BINS
+    hue_block = np.zeros(VIBE_HUE_BINS + 2)
+    low = int(hue_position) % VIBE_HUE_BINS
+    hue_block[low] += chroma_weight * (1 - (hue_position - int(hue_position)))
+    hue_block[(low + 1) % VIBE_HUE_BINS] += chroma_weight * (hue_position - int(hue_position))
+    hue_block[VIBE_HUE_BINS] = 1 - chroma_weight  # neutral greys
+    hue_block[VIBE_HUE_BINS + 1] = lightness / 100
+    
+    return np.concatenate([
+        _unit(freq_block),
+        _unit(hue_block),
+        0.6 * _unit(hashed_embedding(css.get('sound_texture', ''), VIBE_TEXTURE_DIM)),
+        1.2 * _unit(hashed_embedding(css.get('emotion_label', ''), VIBE_EMOTION_DIM))
+    ]).astype(np.float32)
+
+def fold_vibe_signature(signature: Optional[np.ndarray], last_at, css: dict) -> np.ndarray:
+    """Exponentially weighted update; older signal also decays with the gap since the last snapshot"""
+    features = vibe_features(css)
+    if signature is None:
+        return features
+    keep = 1 - VIBE_SIGNATURE_ALPHA
+    if last_at:
+        try:
+            gap_hours = (as_utc(css['timestamp']) - as_utc(last_at)).total_seconds() / 3600
+            keep *= 0.5 ** (max(gap_hours, 0) / VIBE_SIGNATURE_HALF_LIFE_HOURS)
+        except (TypeError, ValueError):
+            pass
+    return (keep * signature + (1 - keep) * features).astype(np.float32)
+
+class VibeIndex:
+    """In-memory cosine nearest-neighbour index over every user's vibe signature"""
+    def __init__(self, dim: int = VIBE_DIM):
+        self.dim = dim
+        self.matrix = np.zeros((1024, dim), dtype=np.float32)
+        self.user_ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.recent_vibes: Dict[str, str] = {}
+        self.synced_at: Optional[datetime] = None
+    
+    def __len__(self):
+        return len(self.user_ids)
+    
+    def upsert(self, user_id: str, vector: np.ndarray, recent_vibe: str = 'Unknown'):
+        row = self.rows.get(user_id)
+        if row is None:
+            row = len(self.user_ids)
+            if row == self.matrix.shape[0]:
+                self.matrix = np.vstack([self.matrix, np.zeros_like(self.matrix)])
+            self.rows[user_id] = row
+            self.user_ids.append(user_id)
+        self.matrix[row] = _unit(np.asarray(vector, dtype=np.float32))
+        self.recent_vibes[user_id] = recent_vibe
+    
+    def vector(self, user_id: str) -> Optional[np.ndarray]:
+        row = self.rows.get(user_id)
+        return None if row is None else self.matrix[row]
+    
+    def query(self, user_id: str, k: int, min_similarity: float = VIBE_RADAR_MIN_SIMILARITY) -> tuple:
+        """Return ([(user_id, similarity)] best first, total users above min_similarity)"""
+        query = self.vector(user_id)
+        if query is None or len(self) < 2:
+            return [], 0
+        scores = self.matrix[:len(self)] @ query
+        scores[self.rows[user_id]] = -1.0
+        total = int((scores >= min_similarity).sum())
+        k = min(k, total)
+        if k <= 0:
+            return [], total
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.user_ids[i], float(scores[i])) for i in top], total
+    
+    def _apply(self, doc: dict):
+        self.upsert(doc['user_id'], np.frombuffer(doc['vector'], dtype=np.float32), doc.get('recent_vibe', 'Unknown'))
+    
+    async def record_css(self, css: dict):
+        """Fold a freshly written snapshot into its author's stored signature"""
+        current = await db.vibe_signatures.find_one({"user_id": css['user_id']}, {"_id": 0})
+        previous = np.frombuffer(current['vector'], dtype=np.float32) if current else None
+        vector = fold_vibe_signature(previous, current.get('last_css_at') if current else None, css)
+        doc = {
+            "user_id": css['user_id'], "vector": Binary(vector.tobytes()), "recent_vibe": css.get('emotion_label', 'Unknown'),
+            "last_css_at": css['timestamp'], "updated_at": utc_now()
+        }
+        await db.vibe_signatures.update_one({"user_id": css['user_id']}, {"$set": doc, "$inc": {"count": 1}}, upsert=True)
+        self._apply(doc)
+    
+    async def rebuild(self, user_id: str) -> bool:
+        """Recompute a signature from the user's recent history (backfill for pre-existing data)"""
+        css_list = await db.css_snapshots.find({"user_id": user_id}, {"_id": 0}).sort("timestamp", -1).limit(20).to_list(20)
+        if not css_list:
+            return False
+        vector, last_at = None, None
+        for css in reversed(css_list):
+            vector = fold_vibe_signature(vector, last_at, css)
+            last_at = css['timestamp']
+        doc = {
+            "user_id": user_id, "vector": Binary(vector.tobytes()), "recent_vibe": css_list[0].get('emotion_label', 'Unknown'),
+            "last_css_at": last_at, "count": len(css_list), "updated_at": utc_now()
+        }
+        await db.vibe_signatures.update_one({"user_id": user_id}, {"$set": doc}, upsert=True)
+        self._apply(doc)
+        return True
+    
+    async def sync(self):
+        """Pull signatures written since the last sync (by this or any other worker).
+
+        Only rows read here advance synced_at, and each sync re-reads VIBE_INDEX_SYNC_OVERLAP_SECONDS
+        before it, so another worker's write with a slightly earlier updated_at is not skipped.
+        """
+        query = {"updated_at": {"$gte": self.synced_at - timedelta(seconds=VIBE_INDEX_SYNC_OVERLAP_SECONDS)}} if self.synced_at else {}
+        newest = self.synced_at
+        async for doc in db.vibe_signatures.find(query, {"_id": 0, "user_id": 1, "vector": 1, "recent_vibe": 1, "updated_at": 1}):
+            self._apply(doc)
+            updated_at = as_utc(doc.get('updated_at'))
+            if updated_at and (newest is None or updated_at > newest):
+                newest = updated_at
+        self.synced_at = newest
+    
+    async def backfill(self):
+        async for row in db.css_snapshots.aggregate([{"$group": {"_id": "$user_id"}}]):
+            if row['_id'] not in self.rows:
+                await self.rebuild(row['_id'])
+    
+    async def run(self):
+        try:
+            await self.sync()
+            await self.backfill()
+        except Exception as e:
+            logging.warning(f"Vibe index warmup: {e}")
+        while True:
+            await asyncio.sleep(VIBE_INDEX_REFRESH_SECONDS)
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.warning(f"Vibe index sync: {e}")
+
+vibe_index = VibeIndex()
+
+# Empathy Index
+def normalize_term(text: str) -> str:
+    return " ".join(re.findall(r"\w+", unicodedata.normalize("NFKC", text or "").casefold()))
+
+class EmpathyIndex:
+    """Inverted index from normalized emotion labels / sound textures to the users who feel them.
+
+    Each user keeps decayed term weights in empathy_terms; empathy_postings holds one
+    (term, user_id, weight) row per term so candidates only come from users sharing a term.
+    """
+    WRITE_ATTEMPTS = 5
+    
+    @staticmethod
+    def terms_for(css: dict) -> List[str]:
+        terms = []
+        emotion = normalize_term(css.get('emotion_label', ''))
+        texture = normalize_term(css.get('sound_texture', ''))
+        if emotion:
+            terms.append(f"e:{emotion}")
+        if texture:
+            terms.append(f"t:{texture}")
+        return terms
+    
+    async def _write(self, user_id: str, current: Optional[dict], new_terms: Dict[str, float], snapshot_count: int) -> bool:
+        """Compare-and-set the user's terms against the version read; False if another write got there first"""
+        old_terms = (current or {}).get('terms', {})
+        total = sum(new_terms.values())
+        doc = {"terms": new_terms, "total_weight": total, "snapshot_count": snapshot_count}
+        if current is None:
+            try:
+                await db.empathy_terms.insert_one({"user_id": user_id, **doc, "version": 1})
+            except DuplicateKeyError:
+                return False
+        else:
+            result = await db.empathy_terms.update_one(
+                {"user_id": user_id, "version": current.get('version')}, {"$set": doc, "$inc": {"version": 1}}
+            )
+            if not result.matched_count:
+                return False
+        
+        postings = [
+            UpdateOne({"term": term, "user_id": user_id},
+                      {"$set": {"weight": weight, "total_weight": total, "snapshot_count": snapshot_count}}, upsert=True)
+            for term, weight in new_terms.items()
+        ]
+        postings += [DeleteOne({"term": term, "user_id": user_id}) for term in old_terms if term not in new_terms]
+        if postings:
+            await db.empathy_postings.bulk_write(postings, ordered=False)
+        
+        # Only the winner of the compare-and-set adjusts df, so concurrent writes cannot double count a term
+        df_changes = [UpdateOne({"term": t}, {"$inc": {"df": 1}}, upsert=True) for t in new_terms if t not in old_terms]
+        df_changes += [UpdateOne({"term": t}, {"$inc": {"df": -1}}) for t in old_terms if t not in new_terms]
+        if df_changes:
+            await db.empathy_term_stats.bulk_write(df_changes, ordered=False)
+        return True
+    
+    async def _update(self, user_id: str, compute):
+        """Read, compute (new terms, snapshot count) and write, retrying when a concurrent write wins"""
+        for _ in range(self.WRITE_ATTEMPTS):
+            current = await db.empathy_terms.find_one({"user_id": user_id}, {"_id": 0})
+            new_terms, snapshot_count = compute(current or {})
+            if await self._write(user_id, current, new_terms, snapshot_count):
+                return
+        logging.warning(f"Empathy terms for {user_id} not updated: too many concurrent writes")
+    
+    async def record_css(self, css: dict):
+        def compute(current: dict) -> tuple:
+            new_terms = {term: weight * EMPATHY_TERM_DECAY for term, weight in current.get('terms', {}).items()}
+            for term in self.terms_for(css):
+                new_terms[term] = new_terms.get(term, 0.0) + 1.0
+            # Terms that have faded out leave the index so postings stay bounded per user
+            return {term: round(weight, 4) for term, weight in new_terms.items() if weight >= 0.05}, current.get('snapshot_count', 0) + 1
+        await self._update(css['user_id'], compute)
+    
+    async def rebuild(self, user_id: str):
+        css_list = await db.css_snapshots.find({"user_id": user_id}, {"_id": 0, "emotion_label": 1, "sound_texture": 1}).sort("timestamp", -1).limit(10).to_list(10)
+        terms: Dict[str, float] = {}
+        for age, css in enumerate(css_list):
+            for term in self.terms_for(css):
+                terms[term] = terms.get(term, 0.0) + EMPATHY_TERM_DECAY ** age
+        terms = {term: round(weight, 4) for term, weight in terms.items()}
+        await self._update(user_id, lambda current: (terms, len(css_list)))
+    
+    async def backfill(self):
+        """Index every user with snapshots but no empathy_terms, streaming their ids from one aggregation"""
+        try:
+            unindexed = db.css_snapshots.aggregate([
+                {"$group": {"_id": "$user_id"}},
+                {"$lookup": {"from": "empathy_terms", "localField": "_id", "foreignField": "user_id", "as": "indexed"}},
+                {"$match": {"indexed": {"$size": 0}}},
+                {"$project": {"_id": 1}}
+            ], allowDiskUse=True)
+            async for row in unindexed:
+                await self.rebuild(row['_id'])
+        except Exception as e:
+            logging.warning(f"Empathy index backfill: {e}")
+    
+    async def matches(self, user_id: str) -> Optional[List[dict]]:
+        """Rank users sharing at least one term by IDF-weighted Jaccard similarity"""
+        me = await db.empathy_terms.find_one({"user_id": user_id}, {"_id": 0})
+        if me is None:
+            # Users with history from before the index existed are indexed on first request
+            await self.rebuild(user_id)
+            me = await db.empathy_terms.find_one({"user_id": user_id}, {"_id": 0})
+        if not me or me.get('snapshot_count', 0) < EMPATHY_MIN_SNAPSHOTS:
+            return None
+        my_terms: Dict[str, float] = me['terms']
+        
+        total_users = max(await db.empathy_terms.estimated_document_count(), 1)
+        stats = await db.empathy_term_stats.find({"term": {"$in": list(my_terms)}}, {"_id": 0}).to_list(len(my_terms))
+        idf = {s['term']: math.log(1 + total_users / max(s.get('df', 1), 1)) for s in stats}
+        
+        async def postings_for(term):
+            return await db.empathy_postings.find(
+                {"term": term, "snapshot_count": {"$gte": EMPATHY_MIN_SNAPSHOTS}}, {"_id": 0}
+            ).sort("weight", -1).limit(EMPATHY_POSTINGS_PER_TERM).to_list(EMPATHY_POSTINGS_PER_TERM)
+        
+        candidates: Dict[str, dict] = {}
+        for term, postings in zip(my_terms, await asyncio.gather(*[postings_for(t) for t in my_terms])):
+            for posting in postings:
+                if posting['user_id'] == user_id:
+                    continue
+                candidate = candidates.setdefault(posting['user_id'], {"shared": 0.0, "overlap": 0.0, "total": posting['total_weight'], "terms": []})
+                overlap = min(my_terms[term], posting['weight'])
+                candidate["shared"] += idf.get(term, 1.0) * overlap
+                candidate["overlap"] += overlap
+                candidate["terms"].append(term)
+        
+        my_total = sum(my_terms.values())
+        max_idf = max(idf.values(), default=1.0)
+        ranked = []
+        for candidate_id, c in candidates.items():
+            union = my_total + c["total"] - c["overlap"]
+            score = c["shared"] / (max_idf * union) if union > 0 else 0.0
+            if score >= EMPATHY_MIN_SCORE:
+                ranked.append({
+                    "user_id": candidate_id,
+                    "empathy_score": round(score * 100, 1),
+                    "shared_emotions": [t[2:] for t in sorted(c["terms"], key=lambda t: -my_terms[t]) if t.startswith("e:")][:3]
+                })
+        ranked.sort(key=lambda x: x['empathy_score'], reverse=True)
+        return ranked
+
+empathy_index = EmpathyIndex()
+
+# Global Feed Buffer
+class GlobalFeedBuffer:
+    """The newest GLOBAL_FEED_BUFFER_SIZE hydrated snapshots, kept in memory with pre-rendered JSON.
+
+    Local creates are pushed immediately; a short sync loop picks up snapshots written by
+    other workers, so the unauthenticated global feed never touches Mongo for its first page.
+    The sync watermark only advances from what the database returned, and each sync re-reads
+    GLOBAL_FEED_SYNC_OVERLAP_SECONDS before it, so neither a local push nor another worker's
+    slightly late write can make the buffer skip a snapshot.
+    """
+    def __init__(self, size: int = GLOBAL_FEED_BUFFER_SIZE, overlap_seconds: float = GLOBAL_FEED_SYNC_OVERLAP_SECONDS):
+        self.size = size
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.items: List[dict] = []
+        self.watermark: Optional[datetime] = None
+        self.ready = False
+        self.rendered: Dict[int, tuple] = {}
+    
+    def _merge(self, new_items: List[dict]):
+        merged = {item['id']: item for item in self.items}
+        merged.update({item['id']: item for item in new_items})
+        self.items = sorted(merged.values(), key=lambda item: (as_utc(item['timestamp']), item['id']), reverse=True)[:self.size]
+        self.rendered = {}
+    
+    def _advance(self, items: List[dict]):
+        if items:
+            newest = max(as_utc(item['timestamp']) for item in items)
+            self.watermark = max(self.watermark, newest) if self.watermark else newest
+    
+    async def seed(self):
+        items = await db.css_snapshots.find({}, {"_id": 0}).sort(KEYSET_SORT).limit(self.size).to_list(self.size)
+        self._advance(items)
+        self.items = []
+        self._merge(await hydrate_feed(items))
+        self.ready = True
+    
+    async def push(self, css: dict):
+        item = {k: v for k, v in css.items() if k != '_id'}
+        self._merge(await hydrate_feed([item]))
+    
+    async def sync(self):
+        query = time_range("timestamp", gte=self.watermark - self.overlap) if self.watermark else {}
+        found = await db.css_snapshots.find(query, {"_id": 0}).sort(KEYSET_SORT).limit(self.size).to_list(self.size)
+        self._advance(found)
+        known = {item['id'] for item in self.items}
+        new_items = [item for item in found if item['id'] not in known]
+        if new_items:
+            self._merge(await hydrate_feed(new_items))
+        await self.refresh_reactions()
+    async def refresh_profile(self, user_id: str):
+        if any(item['user_id'] == user_id for item in self.items):
+            self._merge(await hydrate_profiles([dict(item) for item in self.items if item['user_id'] == user_id]))
+    
+    async def refresh_reactions(self, css_id: Optional[str] = None):
+        """Re-read counters for buffered items (or one of them); re-render only if something changed"""
+        items = [item for item in self.items if css_id is None or item['id'] == css_id]
+        if not items:
+            return
+        counts = await reactions.counts([item['id'] for item in items])
+        changed = [item for item in items if item.get('reaction_counts') != counts.get(item['id'], {})]
+        if changed:
+            self._merge([{**item, "reaction_counts": counts.get(item['id'], {})} for item in changed])
+    
+    def render(self, limit: int) -> tuple:
+        """(etag, body) for the first page of `limit` items, serialized once per change"""
+        if limit not in self.rendered:
+            feed = self.items[:limit]
+            body = json.dumps({"feed": feed, **page_cursors(feed, limit)}, ensure_ascii=False, separators=(",", ":"), default=json_default).encode()
+            self.rendered[limit] = (f'"{hashlib.sha1(body).hexdigest()[:20]}"', body)
+        return self.rendered[limit]
+    
+    async def run(self):
+        while True:
+            try:
+                if self.ready:
+                    await self.sync()
+                else:
+                    await self.seed()
+            except Exception as e:
+                logging.warning(f"Global feed buffer: {e}")
+            await asyncio.sleep(GLOBAL_FEED_SYNC_SECONDS)
+
+global_feed = GlobalFeedBuffer()
+
+# Coach Sessions
+COACH_SUMMARY_PROMPT = "You keep the memory of an empathetic coaching conversation. Fold the new turns into the current summary: the user's situation, feelings, goals and the suggestions already given. Stay under 120 words and write in the language of the conversation."
+
+def estimate_tokens(messages: List[dict]) -> int:
+    """Conservative token count for chat messages (~3 characters per token plus per-message overhead)"""
+    return sum(math.ceil(len(m['content']) / 3) + 4 for m in messages)
+
+class CoachSessions:
+    """Append-only coach transcripts with a rolling summary.
+
+    Each turn is one coach_messages document, ordered by a per-session seq reserved with an atomic $inc,
+    so concurrent messages never overwrite each other. Turns older than the last COACH_VERBATIM_MESSAGES
+    are folded into the session's `summary` in the background, and the prompt is trimmed to
+    COACH_PROMPT_TOKEN_BUDGET, so per-turn cost stays flat however long a session runs.
+    """
+    def __init__(self, window: int = COACH_CONTEXT_MESSAGES, verbatim: int = COACH_VERBATIM_MESSAGES,
+                 batch: int = COACH_SUMMARY_BATCH, budget: int = COACH_PROMPT_TOKEN_BUDGET):
+        self.window = window
+        self.verbatim = verbatim
+        self.batch = batch
+        self.budget = budget
+        self.summarizing = set()
+    
+    async def reserve(self, session_id: str, user_id: str, count: int = 2) -> Optional[tuple]:
+        """Claim `count` seqs for the caller's session; (session, first seq) or None"""
+        session = await db.coach_sessions.find_one_and_update(
+            {"id": session_id, "user_id": user_id},
+            {"$inc": {"message_count": count}},
+            projection={"_id": 0, "messages": {"$slice": -self.window}, "message_count": 1, "summary": 1, "summarized_seq": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not session:
+            return None
+        return session, session['message_count'] - count
+    
+    async def history(self, session: dict, session_id: str, before_seq: int) -> List[dict]:
+        """Turns not yet folded into the summary (at most `window`), oldest first"""
+        summarized_seq = session.get('summarized_seq') or 0
+        recent = await db.coach_messages.find(
+            {"session_id": session_id, "seq": {"$gte": summarized_seq, "$lt": before_seq}}, {"_id": 0, "role": 1, "content": 1}
+        ).sort("seq", -1).limit(self.window).to_list(self.window)
+        # Sessions started before coach_messages existed keep their turns in the embedded array until adopt_legacy moves them
+        legacy = [{"role": m['role'], "content": m['content']} for m in session.get('messages') or []]
+        return (legacy + recent[::-1])[-self.window:]
+    
+    def build_prompt(self, system_message: str, session: dict, history: List[dict], user_turn: dict) -> List[dict]:
+        """System prompt, summary, then as many recent turns as fit the token budget"""
+        prompt = [{"role": "system", "content": system_message}]
+        if session.get('summary'):
+            prompt.append({"role": "system", "content": f"Summary of the earlier conversation: {session['summary']}"})
+        
+        remaining = self.budget - estimate_tokens(prompt)
+        if estimate_tokens([user_turn]) > remaining:
+            user_turn = {**user_turn, "content": user_turn['content'][:max(0, remaining - 4) * 3]}
+        remaining -= estimate_tokens([user_turn])
+        
+        kept = []
+        for message in reversed(history):
+            cost = estimate_tokens([message])
+            if cost > remaining:
+                break
+            kept.append(message)
+            remaining -= cost
+        return prompt + kept[::-1] + [user_turn]
+    
+    async def append(self, session: dict, session_id: str, first_seq: int, messages: List[dict]):
+        now = utc_now()
+        await db.coach_messages.insert_many([
+            {"session_id": session_id, "seq": first_seq + i, "role": m['role'], "content": m['content'], "created_at": now}
+            for i, m in enumerate(messages)
+        ])
+        unsummarized = first_seq + len(messages) - (session.get('summarized_seq') or 0)
+        legacy = 'messages' in session
+        if (legacy or unsummarized >= self.verbatim + self.batch) and session_id not in self.summarizing:
+            self.summarizing.add(session_id)
+            asyncio.create_task(self.summarize(session_id))
+    
+    async def adopt_legacy(self, session_id: str, messages: List[dict]) -> int:
+        """Move a session's embedded pre-coach_messages turns to seqs -N..-1; returns the new summarized_seq"""
+        first = -len(messages)
+        if messages:
+            now = utc_now()
+            try:
+                await db.coach_messages.insert_many([
+                    {"session_id": session_id, "seq": first + i, "role": m['role'], "content": m['content'], "created_at": now}
+                    for i, m in enumerate(messages)
+                ], ordered=False)
+            except BulkWriteError:
+                pass  # another worker copied them first
+        # Drop the array only once every turn is stored in coach_messages
+        await db.coach_sessions.update_one(
+            {"id": session_id, "messages": {"$exists": True}},
+            {"$set": {"summarized_seq": first}, "$unset": {"messages": ""}}
+        )
+        return first
+    
+    async def summarize(self, session_id: str):
+        """Fold turns older than the verbatim window into the running summary"""
+        try:
+            session = await db.coach_sessions.find_one(
+                {"id": session_id}, {"_id": 0, "messages": 1, "message_count": 1, "summary": 1, "summarized_seq": 1}
+            )
+            if 'messages' in session:
+                session['summarized_seq'] = await self.adopt_legacy(session_id, session['messages'] or [])
+            start = session.get('summarized_seq') or 0
+            end = session.get('message_count', 0) - self.verbatim
+            if end - start < self.batch:
+                return
+            
+            turns = await db.coach_messages.find(
+                {"session_id": session_id, "seq": {"$gte": start, "$lt": end}}, {"_id": 0, "seq": 1, "role": 1, "content": 1}
+            ).sort("seq", 1).limit(self.batch * 4).to_list(self.batch * 4)
+            if not turns:
+                return
+            end = turns[-1]['seq'] + 1
+            
+            transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+            summary = await llm.chat([
+                {"role": "system", "content": COACH_SUMMARY_PROMPT},
+                {"role": "user", "content": f"Current summary:\n{session.get('summary') or '-'}\n\nNew turns:\n{transcript}"}
+            ], temperature=0.3, max_tokens=COACH_SUMMARY_MAX_TOKENS)
+            
+            # Only advance from the watermark we read, in case another worker folded these turns first
+            await db.coach_sessions.update_one(
+                {"id": session_id, "summarized_seq": {"$in": [start, None]} if start == 0 else start},
+                {"$set": {"summary": summary, "summarized_seq": end}}
+            )
+        except Exception as e:
+            logging.warning(f"Coach summary for {session_id} failed: {e}")
+        finally:
+            self.summarizing.discard(session_id)
+
+coach_sessions = CoachSessions()
+
+# AI Result Cache
+class AIResultCache:
+    """Per-(user, kind, language) AI results, stored in ai_results until the user's next CSS snapshot.
+
+    Each entry records the id of the newest snapshot it was built from (its watermark). create_css
+    drops the user's entries and, with AI_RESULTS_PRECOMPUTE, rebuilds them in the background so
+    the next page view is a single document read.
+    """
+    def __init__(self, precompute: bool = AI_RESULTS_PRECOMPUTE):
+        self.precompute = precompute
+        self.producers: Dict[str, Any] = {}
+    
+    async def get(self, kind: str, user_id: str, language: str) -> dict:
+        doc = await db.ai_results.find_one({"user_id": user_id, "kind": kind, "language": language}, {"_id": 0, "result": 1})
+        if doc:
+            return doc['result']
+        return await self.refresh(kind, user_id, language)
+    
+    async def refresh(self, kind: str, user_id: str, language: str) -> dict:
+        """Run the producer; results without a watermark (not enough data) are returned but not stored"""
+        result, watermark = await self.producers[kind](user_id, language)
+        if watermark:
+            key = {"user_id": user_id, "kind": kind, "language": language}
+            try:
+                await db.ai_results.update_one(key, {"$set": {"result": result, "watermark": watermark, "updated_at": utc_now()}}, upsert=True)
+            except DuplicateKeyError:
+                pass
+            # A snapshot created while the model was answering makes this result stale already
+            latest = await db.css_snapshots.find_one({"user_id": user_id}, {"_id": 0, "id": 1}, sort=KEYSET_SORT)
+            if latest and latest['id'] != watermark:
+                await db.ai_results.delete_one({**key, "watermark": watermark})
+        return result
+    
+    async def invalidate(self, user_id: str):
+        stale = []
+        if self.precompute:
+            stale = await db.ai_results.find({"user_id": user_id}, {"_id": 0, "kind": 1, "language": 1}).to_list(None)
+        await db.ai_results.delete_many({"user_id": user_id})
+        for entry in stale:
+            asyncio.create_task(self._precompute(entry['kind'], user_id, entry['language']))
+    
+    async def _precompute(self, kind: str, user_id: str, language: str):
+        try:
+            await self.refresh(kind, user_id, language)
+        except Exception as e:
+            logging.warning(f"Precomputing {kind} for {user_id} failed: {e}")
+
+ai_results = AIResultCache()
+
+# Background Jobs
+class PermanentJobError(Exception):
+    """Raised by a job handler for a failure that retrying cannot fix; the job fails at once"""
+
+class JobQueue:
+    """Durable jobs in the `jobs` collection, run by JOB_WORKERS async workers per process.
+
+    Workers claim a job with find_one_and_update and hold a lease on it; a job whose worker died
+    becomes claimable again once the lease lapses. Failures retry with exponential backoff up to
+    JOB_MAX_ATTEMPTS; a PermanentJobError fails the job at once. Enqueueing with an idempotency
+    key returns the existing job for that key. Finished jobs are pushed to the owner over the
+    WebSocket user channel.
+    """
+    PUBLIC_FIELDS = {"_id": 0, "id": 1, "kind": 1, "status": 1, "attempts": 1, "result": 1, "error": 1, "created_at": 1, "updated_at": 1}
+    
+    def __init__(self, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.handlers: Dict[str, Any] = {}
+        self.wakeup = asyncio.Event()
+    
+    @staticmethod
+    def view(job: dict) -> dict:
+        """Public fields, with timestamps as ISO strings like the rest of the API"""
+        view = {k: job.get(k) for k in JobQueue.PUBLIC_FIELDS if k != '_id'}
+        for key in ("created_at", "updated_at"):
+            if isinstance(view[key], datetime):
+                view[key] = as_utc(view[key]).isoformat()
+        return view
+    
+    async def enqueue(self, kind: str, user_id: str, payload: dict, idempotency_key: Optional[str] = None) -> dict:
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()), "kind": kind, "user_id": user_id, "payload": payload,
+            "status": "queued", "attempts": 0, "max_attempts": self.max_attempts,
+            "run_at": now, "lease_until": None, "result": None, "error": None,
+            "created_at": now, "updated_at": now
+        }
+        if idempotency_key:
+            job['idempotency_key'] = idempotency_key
+        try:
+            await db.jobs.insert_one(job)
+        except DuplicateKeyError:
+            return self.view(await db.jobs.find_one({"user_id": user_id, "idempotency_key": idempotency_key}, self.PUBLIC_FIELDS))
+        self.wakeup.set()
+        return self.view(job)
+    
+    async def get(self, job_id: str, user_id: str) -> Optional[dict]:
+        job = await db.jobs.find_one({"id": job_id, "user_id": user_id}, self.PUBLIC_FIELDS)
+        return self.view(job) if job else None
+    
+    async def claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db.jobs.find_one_and_update(
+            {"$or": [
+                {"status": "queued", "run_at": {"$lte": now}},
+                {"status": "running", "lease_until": {"$lt": now}}
+            ]},
+            {"$set": {"status": "running", "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS), "updated_at": now}, "$inc": {"attempts": 1}},
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def execute(self, job: dict):
+        now = datetime.now(timezone.utc)
+        try:
+            result = await self.handlers[job['kind']](job)
+        except Exception as e:
+            logging.warning(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: {e}")
+            if job['attempts'] < job['max_attempts'] and not isinstance(e, PermanentJobError):
+                delay = JOB_BACKOFF_BASE_SECONDS * 2 ** (job['attempts'] - 1) * random.uniform(0.8, 1.2)
+                await db.jobs.update_one({"id": job['id']}, {"$set": {
+                    "status": "queued", "run_at": now + timedelta(seconds=delay), "lease_until": None, "error": str(e), "updated_at": now
+                }})
+                return
+            update = {"status": "failed", "error": str(e)}
+        else:
+            update = {"status": "succeeded", "result": result, "error": None}
+        
+        update.update({"lease_until": None, "updated_at": now, "expires_at": now + timedelta(days=JOB_RETENTION_DAYS)})
+        await db.jobs.update_one({"id": job['id']}, {"$set": update})
+        await manager.send_to_user(job['user_id'], {"type": "job_update", "job": self.view({**job, **update})})
+    
+    async def worker(self):
+        while True:
+            try:
+                job = await self.claim()
+                if job:
+                    await self.execute(job)
+                    continue
+            except Exception as e:
+                logging.warning(f"Job worker: {e}")
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    
+    def start(self):
+        for _ in range(self.workers):
+            asyncio.create_task(self.worker())
+
+jobs = JobQueue()
+
+# Avatar Assets
+AVATAR_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}\.webp$")
+
+class LocalBlobStore:
+    """Blobs as files under AVATAR_STORE_DIR, served by /api/media/avatars/{key}"""
+    def __init__(self, root: Path = AVATAR_STORE_DIR, base_url: str = AVATAR_PUBLIC_BASE_URL):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+    
+    def _write(self, key: str, data: bytes):
+        path = self.root / key
+        if path.exists():
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    
+    async def put(self, key: str, data: bytes, content_type: str):
+        await asyncio.to_thread(self._write, key, data)
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        path = self.root / key
+        return await asyncio.to_thread(path.read_bytes) if path.exists() else None
+    
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+class S3BlobStore:
+    """Blobs in AVATAR_S3_BUCKET, served straight from the bucket or a CDN at AVATAR_PUBLIC_BASE_URL"""
+    def __init__(self, bucket: str = AVATAR_S3_BUCKET, base_url: str = AVATAR_PUBLIC_BASE_URL):
+        import boto3
+        self.client = boto3.client('s3')
+        self.bucket = bucket
+        self.base_url = base_url.rstrip('/')
+    
+    async def put(self, key: str, data: bytes, content_type: str):
+        await asyncio.to_thread(
+            self.client.put_object, Bucket=self.bucket, Key=key, Body=data,
+            ContentType=content_type, CacheControl="public, max-age=31536000, immutable"
+        )
+    
+    async def get(self, key: str) -> Optional[bytes]:
+        return None
+    
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+def make_blob_store():
+    return S3BlobStore() if AVATAR_STORE == 's3' else LocalBlobStore()
+
+class AvatarAssets:
+    """Turns a generated (expiring) image URL into content-addressed WebP variants in the blob store"""
+    def __init__(self, store, sizes: List[int] = AVATAR_VARIANT_SIZES):
+        self.store = store
+        self.sizes = sizes
+    
+    async def download(self, url: str) -> bytes:
+        async with httpx.AsyncClient(timeout=OPENAI_IMAGE_TIMEOUT_SECONDS, follow_redirects=True) as client:
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                data = bytearray()
+                async for chunk in response.aiter_bytes():
+                    data.extend(chunk)
+                    if len(data) > AVATAR_MAX_SOURCE_BYTES:
+                        raise ValueError("Avatar source image too large")
+        return bytes(data)
+    
+    def render(self, source: bytes) -> Dict[int, bytes]:
+        image = Image.open(io.BytesIO(source))
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        variants = {}
+        for size in self.sizes:
+            out = io.BytesIO()
+            ImageOps.fit(image, (size, size), Image.LANCZOS).save(out, "WEBP", quality=85, method=4)
+            variants[size] = out.getvalue()
+        return variants
+    
+    async def ingest(self, url: str) -> Dict[str, str]:
+        """Download, resize and store; returns {"64": url, "128": url, ...}"""
+        source = await self.download(url)
+        variants = await asyncio.to_thread(self.render, source)
+        urls = {}
+        for size, data in variants.items():
+            key = f"{hashlib.sha256(data).hexdigest()}.webp"
+            await self.store.put(key, data, "image/webp")
+            urls[str(size)] = self.store.url(key)
+        return urls
+
+avatar_assets = AvatarAssets(make_blob_store())
+
+# Room Catalog
+class RoomCatalog:
+    """community_rooms held in memory, pre-rendered per language and category.
+
+    The catalog is small and rarely edited, so the list endpoints serve bytes rendered once per
+    change and never query Mongo. Edits (a seed_rooms.py run, member counts from other workers)
+    arrive through a change stream on community_rooms, or on a standalone server through a full
+    reload every ROOM_CATALOG_SYNC_SECONDS; this worker's own joins and leaves apply immediately.
+    """
+    TRENDING_LIMIT = 10
+    
+    def __init__(self):
+        self.rooms: Dict[str, dict] = {}
+        self.keys: Dict[Any, str] = {}
+        self.ready = False
+        self.watching = True
+        self.rendered: Dict[tuple, tuple] = {}
+    
+    async def load(self):
+        rooms = await db.community_rooms.find({}).to_list(None)
+        self.keys = {room['_id']: room['id'] for room in rooms}
+        self.rooms = {room['id']: {k: v for k, v in room.items() if k != '_id'} for room in rooms}
+        self.rendered = {}
+        self.ready = True
+    
+    def put(self, room: dict):
+        self.keys[room['_id']] = room['id']
+        self.rooms[room['id']] = {k: v for k, v in room.items() if k != '_id'}
+        self.rendered = {}
+    
+    def remove(self, key):
+        self.rooms.pop(self.keys.pop(key, None), None)
+        self.rendered = {}
+    
+    def adjust_members(self, room_id: str, delta: int):
+        room = self.rooms.get(room_id)
+        if room:
+            room['member_count'] = room.get('member_count', 0) + delta
+            self.rendered = {}
+    
+    @staticmethod
+    def localize(room: dict, language: str) -> dict:
+        if language != 'en':
+            return room
+        return {**room, **{field: room[f"{field}_en"] for field in ("name", "description") if f"{field}_en" in room}}
+    
+    def _render(self, key: tuple, rooms: List[dict], cache: bool = True) -> tuple:
+        body = json.dumps({"rooms": rooms}, ensure_ascii=False, separators=(",", ":"), default=json_default).encode()
+        entry = (f'"{hashlib.sha1(body).hexdigest()[:20]}"', body)
+        if cache:
+            self.rendered[key] = entry
+        return entry
+    
+    def render(self, language: str = 'tr', category: Optional[str] = None) -> tuple:
+        """(etag, body) for the room list; unknown categories render an empty list without being cached"""
+        language = 'en' if language == 'en' else 'tr'
+        key = ("list", language, category)
+        if key in self.rendered:
+            return self.rendered[key]
+        rooms = [self.localize(room, language) for room in self.rooms.values() if not category or room.get('category') == category]
+        return self._render(key, rooms, cache=bool(rooms) or not category)
+    
+    def render_trending(self) -> tuple:
+        """(etag, body) for the rooms ranked by room_trending, topped up with curated is_trending rooms"""
+        key = ("trending",)
+        if key in self.rendered:
+            return self.rendered[key]
+        ranked = [{**self.rooms[room_id], "is_trending": True, "trending_score": round(score, 3)} for room_id, score in room_trending.ranking if room_id in self.rooms]
+        seen = {room['id'] for room in ranked}
+        curated = sorted((room for room in self.rooms.values() if room.get('is_trending') and room['id'] not in seen),
+                         key=lambda room: room.get('member_count', 0), reverse=True)
+        return self._render(key, (ranked + curated)[:self.TRENDING_LIMIT])
+    
+    def invalidate_trending(self):
+        self.rendered.pop(("trending",), None)
+    
+    async def watch(self):
+        async with db.community_rooms.watch(full_document='updateLookup') as stream:
+            await self.load()
+            async for change in stream:
+                if change['operationType'] == 'delete':
+                    self.remove(change['documentKey']['_id'])
+                elif change.get('fullDocument'):
+                    self.put(change['fullDocument'])
+                elif change['operationType'] in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                    await self.load()
+    
+    async def run(self):
+        while True:
+            try:
+                if self.watching:
+                    await self.watch()
+                    continue
+                await self.load()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if self.watching:
+                    # Change streams need a replica set; fall back to periodic reloads
+                    logging.info(f"Room catalog change stream unavailable ({e}), reloading every {ROOM_CATALOG_SYNC_SECONDS}s")
+                    self.watching = False
+                    continue
+                logging.warning(f"Room catalog: {e}")
+            except Exception as e:
+                logging.warning(f"Room catalog: {e}")
+            await asyncio.sleep(ROOM_CATALOG_SYNC_SECONDS)
+
+room_catalog = RoomCatalog()
+
+# Room Trending
+class RoomTrending:
+    """Activity-based room ranking from joins, snapshots by members and live socket occupancy.
+
+    Events are counted in memory and flushed once per tick as $inc upserts into
+    TRENDING_BUCKET_MINUTES buckets in room_activity, so every worker's activity lands in the same
+    counters. The same tick runs one aggregation that weighs each bucket by an exponential decay
+    with a TRENDING_HALF_LIFE_HOURS half-life and keeps the top rooms; the endpoint only reads that
+    ranking. Occupancy is recorded as socket-seconds, so it sums across workers.
+    """
+    WEIGHTS = {"joins": 3.0, "snapshots": 1.0, "sockets": 2.0}  # sockets: per socket held open for a whole bucket
+    
+    def __init__(self, limit: int = RoomCatalog.TRENDING_LIMIT, bucket_minutes: int = TRENDING_BUCKET_MINUTES,
+                 window_hours: float = TRENDING_WINDOW_HOURS, half_life_hours: float = TRENDING_HALF_LIFE_HOURS):
+        self.limit = limit
+        self.bucket_seconds = bucket_minutes * 60
+        self.window = timedelta(hours=window_hours)
+        self.half_life_ms = half_life_hours * 3600 * 1000
+        self.pending: Dict[tuple, Dict[str, float]] = {}
+        self.ranking: List[tuple] = []
+        self.sampled_at = time.monotonic()
+    
+    def bucket(self, now: Optional[datetime] = None) -> datetime:
+        epoch = int((now or utc_now()).timestamp()) // self.bucket_seconds * self.bucket_seconds
+        return datetime.fromtimestamp(epoch, timezone.utc)
+    
+    def record(self, room_id: str, field: str, amount: float = 1):
+        counts = self.pending.setdefault((room_id, self.bucket()), {})
+        counts[field] = counts.get(field, 0) + amount
+    
+    async def record_snapshot(self, css: dict):
+        async for membership in db.room_memberships.find({"user_id": css['user_id']}, {"_id": 0, "room_id": 1}):
+            self.record(membership['room_id'], "snapshots")
+    
+    def sample_occupancy(self):
+        now = time.monotonic()
+        elapsed, self.sampled_at = now - self.sampled_at, now
+        for room_id, sockets in manager.active_connections.items():
+            if room_id in room_catalog.rooms:
+                self.record(room_id, "socket_seconds", round(len(sockets) * elapsed, 1))
+    
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        ops = [UpdateOne({"room_id": room_id, "bucket": bucket}, {"$inc": counts}, upsert=True) for (room_id, bucket), counts in pending.items()]
+        try:
+            await db.room_activity.bulk_write(ops, ordered=False)
+        except Exception as e:
+            # Keep unwritten counts for the next tick; of a partial write only the failed upserts are retried
+            entries = list(pending.items())
+            if isinstance(e, BulkWriteError):
+                entries = [entries[error['index']] for error in e.details.get('writeErrors', [])]
+            for key, counts in entries:
+                merged = self.pending.setdefault(key, {})
+                for field, amount in counts.items():
+                    merged[field] = merged.get(field, 0) + amount
+            raise
+    
+    def pipeline(self, now: datetime) -> List[dict]:
+        activity = {"$add": [
+            {"$multiply": [{"$ifNull": ["$joins", 0]}, self.WEIGHTS["joins"]]},
+            {"$multiply": [{"$ifNull": ["$snapshots", 0]}, self.WEIGHTS["snapshots"]]},
+            {"$multiply": [{"$ifNull": ["$socket_seconds", 0]}, self.WEIGHTS["sockets"] / self.bucket_seconds]}
+        ]}
+        decay = {"$exp": {"$multiply": [-math.log(2) / self.half_life_ms, {"$subtract": [now, "$bucket"]}]}}
+        return [
+            {"$match": {"bucket": {"$gte": now - self.window}}},
+            {"$group": {"_id": "$room_id", "score": {"$sum": {"$multiply": [activity, decay]}}}},
+            {"$match": {"score": {"$gt": 0}}},
+            {"$sort": {"score": -1, "_id": 1}},
+            # Headroom for rooms that have since left the catalog
+            {"$limit": self.limit * 2}
+        ]
+    
+    async def recompute(self):
+        rows = await db.room_activity.aggregate(self.pipeline(utc_now())).to_list(None)
+        ranking = [(row['_id'], row['score']) for row in rows]
+        if ranking != self.ranking:
+            self.ranking = ranking
+            room_catalog.invalidate_trending()
+    
+    async def tick(self):
+        self.sample_occupancy()
+        await self.flush()
+        await self.recompute()
+    
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logging.warning(f"Room trending: {e}")
+            await asyncio.sleep(TRENDING_RECOMPUTE_SECONDS)
+
+room_trending = RoomTrending()
+
 # AI Functions
 async def generate_css_with_ai(emotion_input: str, language: str = 'tr') -> dict:
     try:
@@ -189,17 +1949,14 @@ SADECE şu alanları içeren geçerli JSON döndür:
 }
 Tüm değerler doğru tipte olmalı. light_frequency sayı (float) olmalı, string değil. Tüm metinler Türkçe olmalı."""
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+        content = await llm.chat(
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Emotion: {emotion_input}"}
             ],
-            temperature=0.8,
-            timeout=30
+            temperature=0.8
         )
         
-        content = response.choices[0].message.content
         if "```json" in content:
             content = content.split("```json")[1].split("```")[0].strip()
         elif "```" in content:
@@ -232,6 +1989,10 @@ Tüm değerler doğru tipte olmalı. light_frequency sayı (float) olmalı, stri
 async def root():
     return {"message": "CogitoSync v3.0 - Production", "version": "3.0.0"}
 
+@api_router.get("/metrics")
+async def metrics():
+    return {"css_cache": css_cache.metrics(), "user_cache": user_cache.metrics(), "password_hasher": password_hasher.metrics(), "websockets": {**manager.stats, "connections": len(manager.connections), "users_online": len(manager.user_connections), "rooms": len(manager.active_connections)}, "llm_in_flight": llm.in_flight}
+
 # Auth
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserRegister):
@@ -239,35 +2000,38 @@ async def register(user_data: UserRegister):
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    user = User(email=user_data.email, password_hash=hash_password(user_data.password))
+    user = User(email=user_data.email, password_hash=await hash_password(user_data.password))
     doc = user.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('premium_expires_at'):
-        doc['premium_expires_at'] = doc['premium_expires_at'].isoformat()
     await db.users.insert_one(doc)
     
-    token = create_access_token({"user_id": user.id, "email": user.email})
+    token = create_access_token(user_claims(doc))
     return TokenResponse(access_token=token, user_id=user.id, email=user.email, is_premium=user.is_premium)
 
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(user_data: UserLogin):
     user = await db.users.find_one({"email": user_data.email}, {"_id": 0})
-    if not user or not verify_password(user_data.password, user['password_hash']):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await password_hasher.verify_and_update(user_data.password, user['password_hash'])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Cost parameters changed since this hash was created; upgrade it transparently
+        await db.users.update_one({"id": user['id']}, {"$set": {"password_hash": new_hash}})
     
-    token = create_access_token({"user_id": user['id'], "email": user['email']})
+    token = create_access_token(user_claims(user))
     return TokenResponse(access_token=token, user_id=user['id'], email=user['email'], is_premium=user.get('is_premium', False))
 
 # CSS
-@api_router.post("/css/create", response_model=CSS)
-async def create_css(css_input: CSSCreate, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
-    css_data = await generate_css_with_ai(css_input.emotion_input, css_input.language or 'tr')
+async def record_css(user_id: str, css_input: CSSCreate, css_id: Optional[str] = None) -> dict:
+    """Generate, store and index one snapshot; returns the stored document"""
+    css_data = await css_cache.generate(css_input.emotion_input, css_input.language or 'tr', bypass=css_input.bypass_cache)
     location_hash = None
     if css_input.location:
         location_hash = hash_location(css_input.location['lat'], css_input.location['lon'])
     
     css = CSS(
-        user_id=current_user['id'],
+        user_id=user_id,
         color=css_data['color'],
         light_frequency=css_data['light_frequency'],
         sound_texture=css_data['sound_texture'],
@@ -275,23 +2039,58 @@ async def create_css(css_input: CSSCreate, background_tasks: BackgroundTasks, cu
         description=css_data['description'],
         location_hash=location_hash
     )
+    if css_id:
+        css.id = css_id
     
     doc = css.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     await db.css_snapshots.insert_one(doc)
+    doc.pop('_id', None)
     
     # Update profile CSS count
-    await db.profiles.update_one({"user_id": current_user['id']}, {"$inc": {"css_count": 1}})
-    
-    # Broadcast to WebSocket
-    background_tasks.add_task(manager.broadcast, {"type": "new_css", "data": doc}, "global")
-    
-    return css
+    await db.profiles.update_one({"user_id": user_id}, {"$inc": {"css_count": 1}})
+    await vibe_index.record_css(doc)
+    await empathy_index.record_css(doc)
+    await ai_results.invalidate(user_id)
+    return doc
+
+def css_followups(doc: dict) -> list:
+    """Fan-out work for a new snapshot that can run after the caller has its answer"""
+    return [
+        (timelines.fan_out, doc),
+        (global_feed.push, doc),
+        (room_trending.record_snapshot, doc),
+        # Broadcast to WebSocket
+        (manager.broadcast, {"type": "new_css", "data": doc}, "global")
+    ]
+
+@api_router.post("/css/create", response_model=CSS)
+async def create_css(css_input: CSSCreate, background_tasks: BackgroundTasks, current_user: dict = Depends(get_current_user)):
+    doc = await record_css(current_user['id'], css_input)
+    for task, *args in css_followups(doc):
+        background_tasks.add_task(task, *args)
+    return doc
+
+@api_router.post("/css/create-job")
+async def create_css_job(css_input: CSSCreate, idempotency_key: Optional[str] = Header(None), current_user: dict = Depends(get_current_user)):
+    """Queue CSS generation; the snapshot arrives in the job result and as a job_update WebSocket event"""
+    return await jobs.enqueue("css", current_user['id'], css_input.model_dump(), idempotency_key)
+
+async def run_css_job(job: dict) -> dict:
+    # The job id doubles as the snapshot id, so a retry after a partial run does not store a second snapshot
+    existing = await db.css_snapshots.find_one({"id": job['id']}, {"_id": 0})
+    if existing:
+        return existing
+    doc = await record_css(job['user_id'], CSSCreate(**job['payload']), css_id=job['id'])
+    for task, *args in css_followups(doc):
+        await task(*args)
+    return doc
+
+jobs.handlers["css"] = run_css_job
 
 @api_router.get("/css/my-history")
-async def get_my_history(current_user: dict = Depends(get_current_user)):
-    css_list = await db.css_snapshots.find({"user_id": current_user['id']}, {"_id": 0}).sort("timestamp", -1).limit(100).to_list(100)
-    return {"history": css_list}
+async def get_my_history(limit: int = MAX_PAGE_SIZE, cursor: Optional[str] = None, since: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    css_list = await fetch_page({"user_id": current_user['id']}, limit, cursor, since)
+    return {"history": css_list, **page_cursors(css_list, min(limit, MAX_PAGE_SIZE), since)}
 
 # V3 Profile
 @api_router.post("/v3/profile/create")
@@ -309,7 +2108,7 @@ async def create_profile(profile_data: ProfileCreate, current_user: dict = Depen
         "id": profile_id, "user_id": current_user['id'], "handle": handle,
         "vibe_identity": profile_data.vibe_identity, "bio": profile_data.bio or "",
         "avatar_url": None, "followers_count": 0, "following_count": 0, "css_count": 0,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": utc_now()
     }
     await db.profiles.insert_one(profile)
     
@@ -329,6 +2128,7 @@ async def update_profile(updates: ProfileUpdate, current_user: dict = Depends(ge
     update_data = {k: v for k, v in updates.model_dump().items() if v is not None}
     if update_data:
         await db.profiles.update_one({"user_id": current_user['id']}, {"$set": update_data})
+        await global_feed.refresh_profile(current_user['id'])
     return {"message": "Updated"}
 
 # Social
@@ -343,11 +2143,12 @@ async def follow_user(target_user_id: str, current_user: dict = Depends(get_curr
     
     await db.social_graph.insert_one({
         "id": str(uuid.uuid4()), "follower_id": current_user['id'], "following_id": target_user_id,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": utc_now()
     })
     
     await db.profiles.update_one({"user_id": current_user['id']}, {"$inc": {"following_count": 1}})
     await db.profiles.update_one({"user_id": target_user_id}, {"$inc": {"followers_count": 1}})
+    await timelines.on_follow(current_user['id'], target_user_id)
     return {"message": "Followed"}
 
 @api_router.post("/v3/social/unfollow/{target_user_id}")
@@ -356,48 +2157,50 @@ async def unfollow_user(target_user_id: str, current_user: dict = Depends(get_cu
     if result.deleted_count > 0:
         await db.profiles.update_one({"user_id": current_user['id']}, {"$inc": {"following_count": -1}})
         await db.profiles.update_one({"user_id": target_user_id}, {"$inc": {"followers_count": -1}})
+        await timelines.on_unfollow(current_user['id'], target_user_id)
     return {"message": "Unfollowed"}
 
 @api_router.get("/v3/social/feed")
-async def get_feed(limit: int = 20, current_user: dict = Depends(get_current_user)):
-    following = await db.social_graph.find({"follower_id": current_user['id']}, {"following_id": 1}).to_list(100)
-    following_ids = [f['following_id'] for f in following]
-    
-    query = {"user_id": {"$in": following_ids}} if following_ids else {}
-    feed = await db.css_snapshots.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
-    
-    for item in feed:
-        profile = await db.profiles.find_one({"user_id": item['user_id']}, {"_id": 0, "handle": 1, "vibe_identity": 1, "avatar_url": 1})
-        item['profile'] = profile or {}
+async def get_feed(limit: int = 20, cursor: Optional[str] = None, since: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    is_personalized = await db.social_graph.find_one({"follower_id": current_user['id']}, {"_id": 1}) is not None
+    if is_personalized:
+        feed = await timelines.read(current_user['id'], limit, cursor, since)
+    else:
+        feed = await fetch_page({}, limit, cursor, since)
+    await hydrate_feed(feed)
     
-    return {"feed": feed, "is_personalized": bool(following_ids)}
+    return {"feed": feed, "is_personalized": is_personalized, **page_cursors(feed, min(limit, MAX_PAGE_SIZE), since)}
 
 @api_router.get("/v3/social/global-feed")
-async def get_global_feed(limit: int = 30):
-    feed = await db.css_snapshots.find({}, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
-    for item in feed:
-        profile = await db.profiles.find_one({"user_id": item['user_id']}, {"_id": 0, "handle": 1, "vibe_identity": 1})
-        item['profile'] = profile or {}
-    return {"feed": feed}
+async def get_global_feed(request: Request, limit: int = 30, cursor: Optional[str] = None, since: Optional[str] = None):
+    if global_feed.ready and not cursor and not since and 0 < limit <= global_feed.size:
+        etag, body = global_feed.render(limit)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+    
+    feed = await fetch_page({}, limit, cursor, since)
+    await hydrate_feed(feed)
+    return {"feed": feed, **page_cursors(feed, min(limit, MAX_PAGE_SIZE), since)}
 
 # AI Coach
 @api_router.post("/v3/coach/start-session")
 async def start_coach_session(current_user: dict = Depends(get_current_user)):
     session_id = str(uuid.uuid4())
     await db.coach_sessions.insert_one({
-        "id": session_id, "user_id": current_user['id'], "messages": [],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "id": session_id, "user_id": current_user['id'], "message_count": 0, "summarized_seq": 0,
+        "created_at": utc_now()
     })
     return {"session_id": session_id}
 
-@api_router.post("/v3/coach/message")
-async def coach_message(msg: CoachMessage, current_user: dict = Depends(get_current_user)):
-    session = await db.coach_sessions.find_one({"id": msg.session_id})
-    if not session or session['user_id'] != current_user['id']:
+async def prepare_coach_turn(msg: CoachMessage, user_id: str) -> tuple:
+    """Reserve seqs for the turn and build its prompt: (session, seq, user turn, prompt, error reply)"""
+    reserved = await coach_sessions.reserve(msg.session_id, user_id)
+    if not reserved:
         raise HTTPException(404, "Session not found")
-    
-    messages = session.get('messages', [])
-    messages.append({"role": "user", "content": msg.message})
+    session, seq = reserved
+    history = await coach_sessions.history(session, msg.session_id, seq)
     
     language = msg.language or 'tr'
     if language == 'en':
@@ -407,38 +2210,82 @@ async def coach_message(msg: CoachMessage, current_user: dict = Depends(get_curr
         system_message = "Sen empatik bir yapay zeka koçusun. Türkçe konuş. Destekleyici, anlayışlı ve yargısız ol. Kısa ve öz cevaplar ver. Kullanıcının duygusal durumunu onaylayarak başla ve küçük, uygulanabilir öneriler sun."
         error_message = "Şu an bağlantı kurmakta zorlanıyorum. Lütfen tekrar dene."
     
+    user_turn = {"role": "user", "content": msg.message}
+    return session, seq, user_turn, coach_sessions.build_prompt(system_message, session, history, user_turn), error_message
+
+@api_router.post("/v3/coach/message")
+async def coach_message(msg: CoachMessage, current_user: dict = Depends(get_current_user)):
+    session, seq, user_turn, prompt, error_message = await prepare_coach_turn(msg, current_user['id'])
+    
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": system_message}, *messages],
-            temperature=0.7, max_tokens=150
-        )
-        reply = response.choices[0].message.content
+        reply = await llm.chat(prompt, temperature=0.7, max_tokens=150)
     except Exception as e:
         logging.error(f"Coach AI error: {e}")
         reply = error_message
     
-    messages.append({"role": "assistant", "content": reply})
-    await db.coach_sessions.update_one({"id": msg.session_id}, {"$set": {"messages": messages}})
+    await coach_sessions.append(session, msg.session_id, seq, [user_turn, {"role": "assistant", "content": reply}])
     return {"reply": reply}
 
+@api_router.post("/v3/coach/message/stream")
+async def coach_message_stream(msg: CoachMessage, current_user: dict = Depends(get_current_user)):
+    """Same turn as /v3/coach/message, sent as Server-Sent Events: `delta` events, then one `done`"""
+    session, seq, user_turn, prompt, error_message = await prepare_coach_turn(msg, current_user['id'])
+    
+    def event(name: str, data: dict) -> str:
+        return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    async def stream():
+        parts = []
+        try:
+            try:
+                async for text in llm.chat_stream(prompt, temperature=0.7, max_tokens=150):
+                    parts.append(text)
+                    yield event("delta", {"text": text})
+            except Exception as e:
+                logging.error(f"Coach AI stream error: {e}")
+                if not parts:
+                    parts.append(error_message)
+                    yield event("delta", {"text": error_message})
+            yield event("done", {"reply": "".join(parts)})
+        finally:
+            # Persist once, including a partial reply when the client went away mid-stream
+            await asyncio.shield(coach_sessions.append(session, msg.session_id, seq, [user_turn, {"role": "assistant", "content": "".join(parts)}]))
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@api_router.get("/v3/coach/session/{session_id}")
+async def get_coach_session(session_id: str, limit: int = 50, current_user: dict = Depends(get_current_user)):
+    """The session's running summary and its most recent stored turns, oldest first"""
+    session = await db.coach_sessions.find_one(
+        {"id": session_id, "user_id": current_user['id']}, {"_id": 0, "message_count": 1, "summary": 1}
+    )
+    if not session:
+        raise HTTPException(404, "Session not found")
+    limit = max(1, min(limit, 200))
+    turns = await db.coach_messages.find(
+        {"session_id": session_id}, {"_id": 0, "seq": 1, "role": 1, "content": 1, "created_at": 1}
+    ).sort("seq", -1).limit(limit).to_list(limit)
+    return {"session_id": session_id, "message_count": session.get('message_count', 0), "summary": session.get('summary'), "messages": turns[::-1]}
+
 # Community Rooms
+def catalog_response(request: Request, rendered: tuple) -> Response:
+    etag, body = rendered
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @api_router.get("/v3/rooms/list")
-async def list_rooms(category: Optional[str] = None, language: str = 'tr'):
-    query = {"category": category} if category else {}
-    rooms = await db.community_rooms.find(query, {"_id": 0}).to_list(100)
-    # Return rooms with localized names and descriptions based on language
-    for room in rooms:
-        if language == 'en' and 'name_en' in room:
-            room['name'] = room['name_en']
-        if language == 'en' and 'description_en' in room:
-            room['description'] = room['description_en']
-    return {"rooms": rooms}
+async def list_rooms(request: Request, category: Optional[str] = None, language: str = 'tr'):
+    if not room_catalog.ready:
+        await room_catalog.load()
+    return catalog_response(request, room_catalog.render(language, category))
 
 @api_router.get("/v3/rooms/trending")
-async def trending_rooms():
-    rooms = await db.community_rooms.find({"is_trending": True}, {"_id": 0}).sort("member_count", -1).limit(10).to_list(10)
-    return {"rooms": rooms}
+async def trending_rooms(request: Request):
+    if not room_catalog.ready:
+        await room_catalog.load()
+    return catalog_response(request, room_catalog.render_trending())
 
 @api_router.post("/v3/rooms/{room_id}/join")
 async def join_room(room_id: str, current_user: dict = Depends(get_current_user)):
@@ -448,9 +2295,11 @@ async def join_room(room_id: str, current_user: dict = Depends(get_current_user)
     
     await db.room_memberships.insert_one({
         "id": str(uuid.uuid4()), "user_id": current_user['id'], "room_id": room_id,
-        "joined_at": datetime.now(timezone.utc).isoformat()
+        "joined_at": utc_now()
     })
     await db.community_rooms.update_one({"id": room_id}, {"$inc": {"member_count": 1}})
+    room_catalog.adjust_members(room_id, 1)
+    room_trending.record(room_id, "joins")
     return {"message": "Joined"}
 
 @api_router.post("/v3/rooms/{room_id}/leave")
@@ -458,21 +2307,28 @@ async def leave_room(room_id: str, current_user: dict = Depends(get_current_user
     result = await db.room_memberships.delete_one({"user_id": current_user['id'], "room_id": room_id})
     if result.deleted_count > 0:
         await db.community_rooms.update_one({"id": room_id}, {"$inc": {"member_count": -1}})
+        room_catalog.adjust_members(room_id, -1)
     return {"message": "Left"}
 
+@api_router.get("/v3/rooms/{room_id}/presence")
+async def room_presence(room_id: str):
+    return {"room_id": room_id, "online": manager.room_occupancy(room_id)}
+
 # Reactions
 @api_router.post("/v3/css/react")
 async def react_to_css(reaction: Reaction, current_user: dict = Depends(get_current_user)):
-    await db.reactions.insert_one({
-        "id": str(uuid.uuid4()), "css_id": reaction.css_id, "user_id": current_user['id'],
-        "reaction_type": reaction.reaction_type, "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    return {"message": "Reacted"}
+    """Toggle a reaction: the first tap adds it, a second tap of the same type removes it"""
+    if not REACTION_TYPE_PATTERN.match(reaction.reaction_type):
+        raise HTTPException(400, "Invalid reaction type")
+    reacted = await reactions.toggle(reaction.css_id, current_user['id'], reaction.reaction_type)
+    await global_feed.refresh_reactions(reaction.css_id)
+    return {"message": "Reacted" if reacted else "Reaction removed", "reacted": reacted}
 
 @api_router.get("/v3/css/{css_id}/reactions")
 async def get_reactions(css_id: str):
-    reactions = await db.reactions.find({"css_id": css_id}, {"_id": 0}).to_list(100)
-    return {"reactions": reactions, "count": len(reactions)}
+    counts = (await reactions.counts([css_id])).get(css_id, {})
+    recent = await db.reactions.find({"css_id": css_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
+    return {"reactions": recent, "counts": counts, "count": sum(counts.values())}
 
 # Premium
 @api_router.get("/v3/premium/check")
@@ -481,129 +2337,189 @@ async def check_premium(current_user: dict = Depends(get_current_user)):
 
 @api_router.post("/v3/premium/subscribe")
 async def subscribe_premium(current_user: dict = Depends(get_current_user)):
-    await db.users.update_one({"id": current_user['id']}, {"$set": {
+    premium = {
         "is_premium": True,
-        "premium_expires_at": (datetime.now(timezone.utc) + timedelta(days=365)).isoformat()
-    }})
-    return {"message": "Premium activated"}
+        "premium_expires_at": utc_now() + timedelta(days=365)
+    }
+    await db.users.update_one({"id": current_user['id']}, {"$set": premium})
+    user_cache.invalidate(current_user['id'])
+    # Tokens carry premium claims, so hand back one that reflects the new state
+    token = create_access_token(user_claims({**current_user, **premium}))
+    return {"message": "Premium activated", "access_token": token}
 
 # Vibe Radar - Find nearby users by vibe
 @api_router.get("/v3/vibe-radar/nearby")
 async def vibe_radar_nearby(current_user: dict = Depends(get_current_user), limit: int = 20):
     """Find users with similar vibes based on CSS patterns"""
     try:
-        # Get current user's recent CSS
-        my_css = await db.css_snapshots.find({"user_id": current_user['id']}, {"_id": 0}).sort("timestamp", -1).limit(10).to_list(10)
-        
-        if not my_css:
+        if vibe_index.vector(current_user['id']) is None and not await vibe_index.rebuild(current_user['id']):
             return {"nearby": [], "message": "Create some CSS to find vibe matches"}
         
-        # Calculate average light frequency as simple vibe metric
-        my_avg_freq = sum([c.get('light_frequency', 0.5) for c in my_css]) / len(my_css)
+        neighbours, total = vibe_index.query(current_user['id'], limit)
+        matches = [
+            {"user_id": user_id, "similarity": round(similarity * 100, 1), "recent_vibe": vibe_index.recent_vibes.get(user_id, 'Unknown')}
+            for user_id, similarity in neighbours
+        ]
         
-        # Find profiles with similar vibe patterns
-        all_profiles = await db.profiles.find({}, {"_id": 0}).limit(100).to_list(100)
-        matches = []
+        # Only the returned page needs full profiles
+        nearby = [match for match in await hydrate_profiles(matches, fields=None) if match['profile']]
+        for match in nearby:
+            match.pop('user_id')
         
-        for profile in all_profiles:
-            if profile['user_id'] == current_user['id']:
-                continue
-            
-            # Get their recent CSS
-            their_css = await db.css_snapshots.find({"user_id": profile['user_id']}, {"_id": 0}).sort("timestamp", -1).limit(10).to_list(10)
-            
-            if their_css:
-                their_avg_freq = sum([c.get('light_frequency', 0.5) for c in their_css]) / len(their_css)
-                similarity = 1 - abs(my_avg_freq - their_avg_freq)
-                
-                if similarity > 0.7:  # 70% similarity threshold
-                    matches.append({
-                        "profile": profile,
-                        "similarity": round(similarity * 100, 1),
-                        "recent_vibe": their_css[0].get('emotion_label', 'Unknown') if their_css else 'Unknown'
-                    })
-        
-        # Sort by similarity
-        matches.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        return {"nearby": matches[:limit], "count": len(matches)}
+        return {"nearby": nearby, "count": total}
     except Exception as e:
         logging.error(f"Vibe radar error: {e}")
         return {"nearby": [], "error": "Could not fetch nearby vibes"}
 
 # Avatar Generation
-@api_router.post("/v3/avatar/generate")
-async def generate_avatar(current_user: dict = Depends(get_current_user)):
+async def run_avatar_job(job: dict) -> dict:
     """Generate AI avatar based on user's CSS history"""
-    try:
-        # Get user's recent CSS
-        css_list = await db.css_snapshots.find({"user_id": current_user['id']}, {"_id": 0}).sort("timestamp", -1).limit(10).to_list(10)
-        
-        if not css_list:
-            return {"error": "Need at least one CSS to generate avatar", "avatar_url": None}
-        
-        # Analyze CSS patterns
-        dominant_colors = [c.get('color', '#8B9DC3') for c in css_list[:3]]
-        emotions = [c.get('emotion_label', '') for c in css_list[:5]]
-        
-        # Create prompt for DALL-E
-        prompt = f"Abstract minimalist avatar representing emotional states: {', '.join(emotions[:3])}. Color palette: {', '.join(dominant_colors)}. Geometric, fluid, meditative style. No text, no face."
-        
-        # Generate with DALL-E
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("API key not configured")
-        
-        response = openai_client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1
-        )
-        
-        avatar_url = response.data[0].url
-        
-        # Update profile with avatar
-        await db.profiles.update_one(
-            {"user_id": current_user['id']},
-            {"$set": {"avatar_url": avatar_url}}
-        )
-        
-        # Store in avatar history
-        await db.avatar_evolutions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": current_user['id'],
-            "avatar_url": avatar_url,
-            "prompt": prompt,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        
-        return {"avatar_url": avatar_url, "message": "Avatar generated"}
-        
-    except Exception as e:
-        logging.error(f"Avatar generation error: {e}")
-        return {"error": "Could not generate avatar", "avatar_url": None, "fallback": True}
+    user_id = job['user_id']
+    # Get user's recent CSS
+    css_list = await db.css_snapshots.find({"user_id": user_id}, {"_id": 0}).sort("timestamp", -1).limit(10).to_list(10)
+    
+    if not css_list:
+        raise PermanentJobError("Need at least one CSS to generate avatar")
+    
+    # Analyze CSS patterns
+    dominant_colors = [c.get('color', '#8B9DC3') for c in css_list[:3]]
+    emotions = [c.get('emotion_label', '') for c in css_list[:5]]
+    
+    # Create prompt for DALL-E
+    prompt = f"Abstract minimalist avatar representing emotional states: {', '.join(emotions[:3])}. Color palette: {', '.join(dominant_colors)}. Geometric, fluid, meditative style. No text, no face."
+    
+    # Generate with DALL-E
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("API key not configured")
+    
+    # A retry after a failed download reuses the image instead of paying for a new one
+    source_url = (job.get('progress') or {}).get('source_url')
+    if not source_url:
+        source_url = await llm.generate_image(prompt, size="1024x1024", quality="standard")
+        await db.jobs.update_one({"id": job['id']}, {"$set": {"progress.source_url": source_url}})
+    
+    # DALL-E URLs expire, so keep our own resized copies
+    variants = await avatar_assets.ingest(source_url)
+    avatar_url = variants[str(AVATAR_FEED_SIZE)]
+    
+    # Update profile with avatar
+    await db.profiles.update_one(
+        {"user_id": user_id},
+        {"$set": {"avatar_url": avatar_url, "avatar_variants": variants}}
+    )
+    await global_feed.refresh_profile(user_id)
+    
+    # Store in avatar history, once per job even if a later step is retried
+    await db.avatar_evolutions.update_one({"id": job['id']}, {"$setOnInsert": {
+        "id": job['id'],
+        "user_id": user_id,
+        "avatar_url": avatar_url,
+        "avatar_variants": variants,
+        "prompt": prompt,
+        "created_at": utc_now()
+    }}, upsert=True)
+    
+    return {"avatar_url": avatar_url, "avatar_variants": variants, "message": "Avatar generated"}
+
+jobs.handlers["avatar"] = run_avatar_job
+
+@api_router.post("/v3/avatar/generate")
+async def generate_avatar(idempotency_key: Optional[str] = Header(None), current_user: dict = Depends(get_current_user)):
+    """Queue avatar generation; poll /v3/jobs/{job_id} or wait for the job_update WebSocket event"""
+    return await jobs.enqueue("avatar", current_user['id'], {}, idempotency_key)
 
 @api_router.get("/v3/avatar/my")
 async def get_my_avatar(current_user: dict = Depends(get_current_user)):
     """Get user's current avatar"""
-    profile = await db.profiles.find_one({"user_id": current_user['id']}, {"_id": 0, "avatar_url": 1})
+    profile = await db.profiles.find_one({"user_id": current_user['id']}, {"_id": 0, "avatar_url": 1, "avatar_variants": 1})
     if not profile:
         return {"avatar_url": None}
-    return {"avatar_url": profile.get('avatar_url')}
+    return {"avatar_url": profile.get('avatar_url'), "avatar_variants": profile.get('avatar_variants')}
+
+@api_router.get("/media/avatars/{key}")
+async def get_avatar_asset(key: str, request: Request):
+    """Content-addressed avatar variants; the key is the hash of the bytes, so they never change"""
+    if not AVATAR_KEY_PATTERN.match(key):
+        raise HTTPException(404, "Not found")
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{key[:-5]}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    data = await avatar_assets.store.get(key)
+    if data is None:
+        raise HTTPException(404, "Not found")
+    return Response(content=data, media_type="image/webp", headers=headers)
+
+# Jobs
+@api_router.get("/v3/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await jobs.get(job_id, current_user['id'])
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
 
 # Mood Journal Timeline
+MOOD_PALETTE_SIZE = 5
+# UTC calendar day of a snapshot, for native dates and not-yet-migrated ISO strings alike
+MOOD_DAY_KEY = {"$cond": [
+    {"$eq": [{"$type": "$timestamp"}, "date"]},
+    {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+    {"$substrBytes": ["$timestamp", 0, 10]}
+]}
+
+async def mood_rollups(user_id: str, cutoff: datetime) -> Dict[str, dict]:
+    """Per-day count, light_frequency stats, dominant emotion and palette, grouped on the server"""
+    rows = await db.css_snapshots.aggregate([
+        {"$match": {"user_id": user_id, **time_range("timestamp", gte=cutoff)}},
+        {"$group": {
+            "_id": {"day": MOOD_DAY_KEY, "emotion": "$emotion_label", "color": "$color"},
+            "count": {"$sum": 1},
+            "frequency_sum": {"$sum": "$light_frequency"},
+            "frequency_min": {"$min": "$light_frequency"},
+            "frequency_max": {"$max": "$light_frequency"}
+        }},
+        {"$group": {
+            "_id": "$_id.day",
+            "count": {"$sum": "$count"},
+            "frequency_sum": {"$sum": "$frequency_sum"},
+            "frequency_min": {"$min": "$frequency_min"},
+            "frequency_max": {"$max": "$frequency_max"},
+            "mix": {"$push": {"emotion": "$_id.emotion", "color": "$_id.color", "count": "$count"}}
+        }},
+        {"$sort": {"_id": 1}}
+    ]).to_list(None)
+    
+    timeline = {}
+    for row in rows:
+        emotions, colors = {}, {}
+        for part in row['mix']:
+            emotions[part.get('emotion') or 'Unknown'] = emotions.get(part.get('emotion') or 'Unknown', 0) + part['count']
+            if part.get('color'):
+                colors[part['color']] = colors.get(part['color'], 0) + part['count']
+        timeline[row['_id']] = {
+            "count": row['count'],
+            "mean_frequency": round(row['frequency_sum'] / row['count'], 3),
+            "min_frequency": row['frequency_min'],
+            "max_frequency": row['frequency_max'],
+            "dominant_emotion": max(emotions.items(), key=lambda x: x[1])[0],
+            "palette": [color for color, _ in sorted(colors.items(), key=lambda x: -x[1])[:MOOD_PALETTE_SIZE]]
+        }
+    return timeline
+
 @api_router.get("/v3/mood-journal/timeline")
-async def mood_timeline(current_user: dict = Depends(get_current_user), days: int = 7):
-    """Get mood timeline for the past N days"""
+async def mood_timeline(current_user: dict = Depends(get_current_user), days: int = 7, mode: str = 'entries'):
+    """Get mood timeline for the past N days; mode=rollup returns one summary per day instead of raw entries"""
     try:
         cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
         
+        if mode == 'rollup':
+            timeline = await mood_rollups(current_user['id'], cutoff_date)
+            return {"timeline": timeline, "total_days": len(timeline), "total_entries": sum(day['count'] for day in timeline.values()), "mode": "rollup"}
+        
         css_list = await db.css_snapshots.find(
             {
                 "user_id": current_user['id'],
-                "timestamp": {"$gte": cutoff_date.isoformat()}
+                **time_range("timestamp", gte=cutoff_date)
             },
             {"_id": 0}
         ).sort("timestamp", 1).to_list(1000)
@@ -611,7 +2527,7 @@ async def mood_timeline(current_user: dict = Depends(get_current_user), days: in
         # Group by day
         timeline = {}
         for css in css_list:
-            date_key = css['timestamp'][:10]  # YYYY-MM-DD
+            date_key = as_utc(css['timestamp']).strftime("%Y-%m-%d")
             if date_key not in timeline:
                 timeline[date_key] = []
             timeline[date_key].append(css)
@@ -621,58 +2537,74 @@ async def mood_timeline(current_user: dict = Depends(get_current_user), days: in
         logging.error(f"Timeline error: {e}")
         return {"timeline": {}, "error": "Could not fetch timeline"}
 
-# AI Coach Insights
-@api_router.get("/v3/ai-coach/insights")
-async def ai_coach_insights(language: str = 'tr', current_user: dict = Depends(get_current_user)):
-    """Get AI-generated insights from CSS history"""
+@api_router.get("/v3/mood-journal/day/{day}")
+async def mood_day_entries(day: str, current_user: dict = Depends(get_current_user), limit: int = 50, cursor: Optional[str] = None):
+    """Raw entries of one UTC day (YYYY-MM-DD), newest first, for drilling into a rollup"""
     try:
-        css_list = await db.css_snapshots.find({"user_id": current_user['id']}, {"_id": 0}).sort("timestamp", -1).limit(30).to_list(30)
-        
-        if not css_list:
-            if language == 'en':
-                return {"insights": [], "message": "Create more CSS for insights"}
-            else:
-                return {"insights": [], "message": "İçgörüler için daha fazla CSS oluştur"}
-        
-        # Analyze patterns
-        emotions = [c.get('emotion_label', '') for c in css_list]
-        frequencies = [c.get('light_frequency', 0.5) for c in css_list]
-        avg_freq = sum(frequencies) / len(frequencies)
-        
-        # Generate AI insight
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("API key not configured")
-        
+        start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(400, "Invalid day")
+    query = {
+        "user_id": current_user['id'],
+        **time_range("timestamp", gte=start, lt=start + timedelta(days=1))
+    }
+    entries = await fetch_page(query, limit, cursor)
+    return {"day": day, "entries": entries, **page_cursors(entries, min(limit, MAX_PAGE_SIZE))}
+
+# AI Coach Insights
+async def produce_coach_insights(user_id: str, language: str) -> tuple:
+    """(insights response, watermark) from the user's last 30 snapshots"""
+    css_list = await db.css_snapshots.find({"user_id": user_id}, {"_id": 0}).sort(KEYSET_SORT).limit(30).to_list(30)
+    
+    if not css_list:
         if language == 'en':
-            prompt = f"""Analyze this user's recent emotional patterns and provide 3-4 short, supportive insights. Write in ENGLISH.
+            return {"insights": [], "message": "Create more CSS for insights"}, None
+        else:
+            return {"insights": [], "message": "İçgörüler için daha fazla CSS oluştur"}, None
+    
+    # Analyze patterns
+    emotions = [c.get('emotion_label', '') for c in css_list]
+    frequencies = [c.get('light_frequency', 0.5) for c in css_list]
+    avg_freq = sum(frequencies) / len(frequencies)
+    
+    # Generate AI insight
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("API key not configured")
+    
+    if language == 'en':
+        prompt = f"""Analyze this user's recent emotional patterns and provide 3-4 short, supportive insights. Write in ENGLISH.
 
 Recent emotions: {', '.join(emotions[:15])}
 Average intensity: {avg_freq:.2f}
 
 Provide practical, empathetic observations about their emotional patterns. Be concise and actionable. Each insight should be 1-2 sentences."""
-        else:
-            prompt = f"""Bu kullanıcının son duygusal örüntülerini analiz et ve 3-4 kısa, destekleyici içgörü sun. TÜRKÇE yaz.
+    else:
+        prompt = f"""Bu kullanıcının son duygusal örüntülerini analiz et ve 3-4 kısa, destekleyici içgörü sun. TÜRKÇE yaz.
 
 Son duygular: {', '.join(emotions[:15])}
 Ortalama yoğunluk: {avg_freq:.2f}
 
 Duygusal örüntüleri hakkında pratik, empatik gözlemler sun. Kısa ve uygulanabilir ol. Her içgörü 1-2 cümle olsun."""
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=200
-        )
-        
-        insight_text = response.choices[0].message.content
-        
-        # Split into individual insights
-        insights = [line.strip() for line in insight_text.split('\n') if line.strip() and len(line.strip()) > 10]
-        
-        return {"insights": insights, "based_on_entries": len(css_list)}
-        
+    insight_text = await llm.chat(
+        [{"role": "user", "content": prompt}],
+        temperature=0.7,
+        max_tokens=200
+    )
+    
+    # Split into individual insights
+    insights = [line.strip() for line in insight_text.split('\n') if line.strip() and len(line.strip()) > 10]
+    
+    return {"insights": insights, "based_on_entries": len(css_list)}, css_list[0]['id']
+
+ai_results.producers["insights"] = produce_coach_insights
+
+@api_router.get("/v3/ai-coach/insights")
+async def ai_coach_insights(language: str = 'tr', current_user: dict = Depends(get_current_user)):
+    """Get AI-generated insights from CSS history"""
+    try:
+        return await ai_results.get("insights", current_user['id'], language)
     except Exception as e:
         logging.error(f"AI insights error: {e}")
         if language == 'en':
@@ -695,51 +2627,53 @@ Duygusal örüntüleri hakkında pratik, empatik gözlemler sun. Kısa ve uygula
             }
 
 # AI Mood Forecast
-@api_router.get("/v3/ai-forecast/predict")
-async def mood_forecast(language: str = 'tr', current_user: dict = Depends(get_current_user)):
-    """Predict mood trends for next 24 hours"""
-    try:
-        css_list = await db.css_snapshots.find({"user_id": current_user['id']}, {"_id": 0}).sort("timestamp", -1).limit(20).to_list(20)
-        
-        if len(css_list) < 5:
-            if language == 'en':
-                return {"forecast": "At least 5 CSS records needed for prediction", "confidence": "low"}
-            else:
-                return {"forecast": "Tahmin için en az 5 CSS kaydı gerekli", "confidence": "düşük"}
-        
-        # Analyze recent trends
-        recent_emotions = [c.get('emotion_label', '') for c in css_list[:10]]
-        frequencies = [c.get('light_frequency', 0.5) for c in css_list[:10]]
-        
-        # Generate forecast with AI
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("API key not configured")
-        
+async def produce_mood_forecast(user_id: str, language: str) -> tuple:
+    """(forecast response, watermark) from the user's last 20 snapshots"""
+    css_list = await db.css_snapshots.find({"user_id": user_id}, {"_id": 0}).sort(KEYSET_SORT).limit(20).to_list(20)
+    
+    if len(css_list) < 5:
         if language == 'en':
-            prompt = f"""Based on these recent emotional states, provide a brief 24-hour mood forecast. Write in ENGLISH.
+            return {"forecast": "At least 5 CSS records needed for prediction", "confidence": "low"}, None
+        else:
+            return {"forecast": "Tahmin için en az 5 CSS kaydı gerekli", "confidence": "düşük"}, None
+    
+    # Analyze recent trends
+    recent_emotions = [c.get('emotion_label', '') for c in css_list[:10]]
+    frequencies = [c.get('light_frequency', 0.5) for c in css_list[:10]]
+    
+    # Generate forecast with AI
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("API key not configured")
+    
+    if language == 'en':
+        prompt = f"""Based on these recent emotional states, provide a brief 24-hour mood forecast. Write in ENGLISH.
 
 Recent states: {', '.join(recent_emotions[:7])}
 
 Give a short, supportive prediction about potential emotional trends (2-3 sentences) and an actionable suggestion."""
-        else:
-            prompt = f"""Bu son duygusal durumlara dayanarak kısa bir 24 saatlik ruh hali tahmini sun. TÜRKÇE yaz.
+    else:
+        prompt = f"""Bu son duygusal durumlara dayanarak kısa bir 24 saatlik ruh hali tahmini sun. TÜRKÇE yaz.
 
 Son durumlar: {', '.join(recent_emotions[:7])}
 
 Olası duygusal eğilimler hakkında kısa, destekleyici bir tahmin (2-3 cümle) ve uygulanabilir bir öneri ver."""
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=150
-        )
-        
-        forecast_text = response.choices[0].message.content
-        
-        return {"forecast": forecast_text, "confidence": "medium", "based_on": len(css_list)}
-        
+    forecast_text = await llm.chat(
+        [{"role": "user", "content": prompt}],
+        temperature=0.7,
+        max_tokens=150
+    )
+    
+    return {"forecast": forecast_text, "confidence": "medium", "based_on": len(css_list)}, css_list[0]['id']
+
+ai_results.producers["forecast"] = produce_mood_forecast
+
+@api_router.get("/v3/ai-forecast/predict")
+async def mood_forecast(language: str = 'tr', current_user: dict = Depends(get_current_user)):
+    """Predict mood trends for next 24 hours"""
+    try:
+        return await ai_results.get("forecast", current_user['id'], language)
     except Exception as e:
         logging.error(f"Forecast error: {e}")
         if language == 'en':
@@ -756,105 +2690,104 @@ Olası duygusal eğilimler hakkında kısa, destekleyici bir tahmin (2-3 cümle)
             }
 
 # Room Dynamics
-@api_router.get("/v3/room/{room_id}/dynamics")
-async def room_dynamics(room_id: str):
-    """Get collective mood dynamics for a room"""
-    try:
-        # Get room members
-        members = await db.room_memberships.find({"room_id": room_id}, {"_id": 0, "user_id": 1}).to_list(100)
-        member_ids = [m['user_id'] for m in members]
+class RoomDynamics:
+    """Collective mood of a room, computed by one aggregation and cached per (room, window).
+
+    The pipeline walks every membership and looks up only that member's snapshots inside the
+    window, grouped by emotion, so the server returns a handful of rows however large the room is.
+    Concurrent requests for the same key share one in-flight aggregation.
+    """
+    def __init__(self, ttl: float = ROOM_DYNAMICS_TTL_SECONDS):
+        self.ttl = ttl
+        self.entries: Dict[tuple, tuple] = {}
+    
+    @staticmethod
+    def pipeline(room_id: str, since: datetime) -> List[dict]:
+        return [
+            {"$match": {"room_id": room_id}},
+            {"$lookup": {
+                "from": "css_snapshots", "localField": "user_id", "foreignField": "user_id", "as": "css",
+                "pipeline": [
+                    {"$match": time_range("timestamp", gte=since)},
+                    {"$group": {
+                        "_id": {"$ifNull": ["$emotion_label", "Unknown"]},
+                        "count": {"$sum": 1},
+                        "frequency": {"$sum": {"$ifNull": ["$light_frequency", 0.5]}}
+                    }}
+                ]
+            }},
+            {"$facet": {
+                "members": [{"$count": "n"}],
+                "active": [{"$match": {"css": {"$ne": []}}}, {"$count": "n"}],
+                "emotions": [
+                    {"$unwind": "$css"},
+                    {"$group": {"_id": "$css._id", "count": {"$sum": "$css.count"}, "frequency": {"$sum": "$css.frequency"}}},
+                    {"$sort": {"count": -1}}
+                ]
+            }}
+        ]
+    
+    async def compute(self, room_id: str, window_hours: float) -> dict:
+        since = datetime.now(timezone.utc) - timedelta(hours=window_hours)
+        result = (await db.room_memberships.aggregate(self.pipeline(room_id, since)).to_list(1))[0]
         
-        if not member_ids:
+        if not result['members']:
             return {"dynamics": {}, "message": "No members in room"}
-        
-        # Get recent CSS from members
-        recent_css = await db.css_snapshots.find(
-            {"user_id": {"$in": member_ids}},
-            {"_id": 0}
-        ).sort("timestamp", -1).limit(50).to_list(50)
-        
-        if not recent_css:
+        if not result['emotions']:
             return {"dynamics": {}, "message": "No recent activity"}
         
-        # Calculate collective metrics
-        emotions = {}
-        colors = []
-        total_freq = 0
-        
-        for css in recent_css:
-            emotion = css.get('emotion_label', 'Unknown')
-            emotions[emotion] = emotions.get(emotion, 0) + 1
-            colors.append(css.get('color', '#8B9DC3'))
-            total_freq += css.get('light_frequency', 0.5)
-        
-        dominant_emotion = max(emotions.items(), key=lambda x: x[1])[0] if emotions else "Mixed"
-        avg_frequency = total_freq / len(recent_css) if recent_css else 0.5
-        
-        dynamics = {
-            "dominant_emotion": dominant_emotion,
-            "emotion_distribution": emotions,
-            "collective_intensity": round(avg_frequency, 2),
-            "active_members": len(set([c['user_id'] for c in recent_css])),
-            "recent_activity_count": len(recent_css)
-        }
-        
-        return {"dynamics": dynamics}
-        
+        total = sum(e['count'] for e in result['emotions'])
+        return {"dynamics": {
+            "dominant_emotion": result['emotions'][0]['_id'],
+            "emotion_distribution": {e['_id']: e['count'] for e in result['emotions']},
+            "collective_intensity": round(sum(e['frequency'] for e in result['emotions']) / total, 2),
+            "active_members": result['active'][0]['n'] if result['active'] else 0,
+            "recent_activity_count": total,
+            "window_hours": window_hours
+        }}
+    
+    async def get(self, room_id: str, window_hours: float = ROOM_DYNAMICS_WINDOW_HOURS) -> dict:
+        key = (room_id, window_hours)
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if not entry or entry[0] < now or (entry[1].done() and entry[1].exception()):
+            if len(self.entries) > 10000:
+                self.entries = {k: v for k, v in self.entries.items() if v[0] >= now}
+            entry = (now + self.ttl, asyncio.ensure_future(self.compute(room_id, window_hours)))
+            self.entries[key] = entry
+        return await asyncio.shield(entry[1])
+
+room_dynamics_cache = RoomDynamics()
+
+@api_router.get("/v3/room/{room_id}/dynamics")
+async def room_dynamics(room_id: str, window_hours: float = ROOM_DYNAMICS_WINDOW_HOURS):
+    """Get collective mood dynamics for a room"""
+    try:
+        return await room_dynamics_cache.get(room_id, min(max(window_hours, 1), 24 * 90))
     except Exception as e:
         logging.error(f"Room dynamics error: {e}")
         return {"dynamics": {}, "error": "Could not fetch dynamics"}
 
 # Empathy Match
 @api_router.get("/v3/empathy/find-match")
-async def empathy_match(current_user: dict = Depends(get_current_user)):
+async def empathy_match(current_user: dict = Depends(get_current_user), limit: int = 10, offset: int = 0):
     """Find empathy match based on emotional resonance"""
     try:
-        # Get user's recent CSS
-        my_css = await db.css_snapshots.find({"user_id": current_user['id']}, {"_id": 0}).sort("timestamp", -1).limit(10).to_list(10)
-        
-        if len(my_css) < 3:
-            return {"match": None, "message": "Need at least 3 CSS entries to find matches"}
-        
-        # Extract emotional signature
-        my_emotions = [c.get('emotion_label', '').lower() for c in my_css]
-        my_textures = [c.get('sound_texture', '').lower() for c in my_css]
+        ranked = await empathy_index.matches(current_user['id'])
+        if ranked is None:
+            return {"match": None, "matches": [], "message": "Need at least 3 CSS entries to find matches"}
         
-        # Find potential matches
-        all_users = await db.profiles.find({}, {"_id": 0, "user_id": 1}).limit(50).to_list(50)
-        matches = []
+        page = [match for match in await hydrate_profiles(ranked[offset:offset + limit], fields=None) if match['profile']]
+        for match in page:
+            match.pop('user_id')
         
-        for profile in all_users:
-            if profile['user_id'] == current_user['id']:
-                continue
-            
-            their_css = await db.css_snapshots.find({"user_id": profile['user_id']}, {"_id": 0}).sort("timestamp", -1).limit(10).to_list(10)
-            
-            if len(their_css) < 3:
-                continue
-            
-            their_emotions = [c.get('emotion_label', '').lower() for c in their_css]
-            their_textures = [c.get('sound_texture', '').lower() for c in their_css]
-            
-            # Calculate emotional overlap
-            emotion_overlap = len(set(my_emotions) & set(their_emotions))
-            texture_overlap = len(set(my_textures) & set(their_textures))
-            
-            empathy_score = (emotion_overlap * 10) + (texture_overlap * 5)
-            
-            if empathy_score > 15:
-                profile_data = await db.profiles.find_one({"user_id": profile['user_id']}, {"_id": 0})
-                matches.append({
-                    "profile": profile_data,
-                    "empathy_score": empathy_score,
-                    "shared_emotions": list(set(my_emotions) & set(their_emotions))[:3]
-                })
-        
-        # Sort by empathy score
-        matches.sort(key=lambda x: x['empathy_score'], reverse=True)
-        
-        best_match = matches[0] if matches else None
-        
-        return {"match": best_match, "total_potential_matches": len(matches)}
+        next_offset = offset + limit if offset + limit < len(ranked) else None
+        return {
+            "match": page[0] if page and offset == 0 else None,
+            "matches": page,
+            "total_potential_matches": len(ranked),
+            "next_offset": next_offset
+        }
         
     except Exception as e:
         logging.error(f"Empathy match error: {e}")
@@ -863,48 +2796,64 @@ async def empathy_match(current_user: dict = Depends(get_current_user)):
 
 # WebSocket
 @app.websocket("/ws/live")
-async def websocket_live(websocket: WebSocket, room_id: str = "global"):
+async def websocket_live(websocket: WebSocket, room_id: str = "global", token: Optional[str] = None):
     """Enhanced WebSocket with mobile reconnection support"""
-    await manager.connect(websocket, room_id)
+    user_id = None
+    if token:
+        try:
+            user_id = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]).get("user_id")
+        except jwt.InvalidTokenError:
+            await websocket.close(code=4401)
+            return
+    connection = await manager.connect(websocket, room_id, user_id)
     
     # Send initial connection confirmation
-    try:
-        await websocket.send_json({
-            "type": "connection",
-            "status": "connected",
-            "room_id": room_id,
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        })
-    except:
-        pass
+    connection.send({
+        "type": "connection",
+        "status": "connected",
+        "room_id": room_id,
+        "authenticated": user_id is not None,
+        "occupancy": manager.room_occupancy(room_id),
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
     
     try:
         # Heartbeat mechanism for mobile stability
         last_ping = datetime.now(timezone.utc)
         
-        while True:
+        while not connection.closed:
             try:
                 # Wait for message with timeout
                 data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
                 
                 # Handle ping/pong
                 if data == "ping":
-                    await websocket.send_text("pong")
+                    connection.enqueue("pong")
                     last_ping = datetime.now(timezone.utc)
+                elif data.startswith("{"):
+                    # Additional room subscriptions over the same socket
+                    command = json.loads(data)
+                    target = command.get("room_id")
+                    if target and command.get("type") == "subscribe":
+                        manager.join(connection, target)
+                        connection.send({"type": "subscribed", "room_id": target, "occupancy": manager.room_occupancy(target)})
+                    elif target and command.get("type") == "unsubscribe":
+                        manager.leave(connection, target)
+                        connection.send({"type": "unsubscribed", "room_id": target})
                 
                 # Check if client is still responsive
                 if (datetime.now(timezone.utc) - last_ping).seconds > 60:
                     # Send ping to check connection
-                    await websocket.send_json({"type": "ping"})
+                    connection.send({"type": "ping"})
                     last_ping = datetime.now(timezone.utc)
                 
             except asyncio.TimeoutError:
                 # Send keep-alive ping
-                try:
-                    await websocket.send_json({"type": "ping"})
-                    last_ping = datetime.now(timezone.utc)
-                except:
+                if not connection.send({"type": "ping"}):
                     break
+                last_ping = datetime.now(timezone.utc)
+            except json.JSONDecodeError:
+                continue
             except:
                 break
                 
@@ -913,7 +2862,7 @@ async def websocket_live(websocket: WebSocket, room_id: str = "global"):
     except Exception as e:
         logging.error(f"WebSocket error: {e}")
     finally:
-        manager.disconnect(websocket, room_id)
+        manager.disconnect(websocket)
 
 app.include_router(api_router)
 app.add_middleware(CORSMiddleware, allow_credentials=True, allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','), allow_methods=["*"], allow_headers=["*"])
@@ -929,14 +2878,61 @@ async def create_indexes():
         await db.profiles.create_index("handle", unique=True)
         await db.css_snapshots.create_index("id", unique=True)
         await db.css_snapshots.create_index([("user_id", 1), ("timestamp", -1)])
+        await db.css_snapshots.create_index([("user_id", 1), ("timestamp", -1), ("id", -1)])
+        await db.css_snapshots.create_index([("timestamp", -1), ("id", -1)])
         await db.social_graph.create_index([("follower_id", 1), ("following_id", 1)], unique=True)
+        await db.social_graph.create_index("following_id")
+        await db.profiles.create_index("followers_count")
+        await db.timelines.create_index([("owner_id", 1), ("timestamp", -1), ("id", -1)])
+        await db.timelines.create_index([("owner_id", 1), ("id", 1)], unique=True)
+        await db.timelines.create_index([("owner_id", 1), ("user_id", 1)])
+        await db.timelines.create_index("created_at", expireAfterSeconds=TIMELINE_TTL_DAYS * 86400)
         await db.community_rooms.create_index("id", unique=True)
+        await db.room_memberships.create_index([("room_id", 1), ("user_id", 1)])
+        await db.room_memberships.create_index("user_id")
+        await db.room_activity.create_index([("room_id", 1), ("bucket", 1)], unique=True)
+        await db.room_activity.create_index("bucket", expireAfterSeconds=int(TRENDING_WINDOW_HOURS * 3600) + TRENDING_BUCKET_MINUTES * 60)
         await db.coach_sessions.create_index("user_id")
+        await db.coach_messages.create_index([("session_id", 1), ("seq", 1)], unique=True)
+        await db.ai_results.create_index([("user_id", 1), ("kind", 1), ("language", 1)], unique=True)
+        await db.jobs.create_index("id", unique=True)
+        await db.jobs.create_index([("status", 1), ("run_at", 1)])
+        await db.jobs.create_index([("user_id", 1), ("idempotency_key", 1)], unique=True, partialFilterExpression={"idempotency_key": {"$exists": True}})
+        await db.jobs.create_index("expires_at", expireAfterSeconds=0)
         await db.reactions.create_index("css_id")
+        await db.reaction_counts.create_index("css_id", unique=True)
+        await db.vibe_signatures.create_index("user_id", unique=True)
+        await db.vibe_signatures.create_index("updated_at")
+        await db.empathy_terms.create_index("user_id", unique=True)
+        await db.empathy_postings.create_index([("term", 1), ("user_id", 1)], unique=True)
+        await db.empathy_postings.create_index([("term", 1), ("weight", -1)])
+        await db.empathy_term_stats.create_index("term", unique=True)
+        if WS_BROKER == 'mongo':
+            await db.ws_events.create_index("created_at", expireAfterSeconds=WS_EVENTS_TTL_SECONDS)
+        if CSS_CACHE_MONGO:
+            await db.css_generation_cache.create_index("key", unique=True)
+            await db.css_generation_cache.create_index("created_at", expireAfterSeconds=CSS_CACHE_TTL_SECONDS)
         logging.info("Database indexes created")
     except Exception as e:
         logging.warning(f"Index creation: {e}")
+    try:
+        await db.reactions.create_index([("css_id", 1), ("user_id", 1), ("reaction_type", 1)], unique=True)
+    except Exception as e:
+        logging.error(f"Unique reaction index not created, run migrate_reactions.py to remove duplicate reactions: {e}")
+
+@app.on_event("startup")
+async def start_background_services():
+    await manager.start()
+    asyncio.create_task(vibe_index.run())
+    asyncio.create_task(empathy_index.backfill())
+    asyncio.create_task(global_feed.run())
+    asyncio.create_task(room_catalog.run())
+    asyncio.create_task(room_trending.run())
+    jobs.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    await manager.broker.stop()
+    await openai_client.close()
+    password_hasher.executor.shutdown(wait=False)
     mongo_client.close()
@@ -144,6 +144,77 @@ class TestCoach:
         data = response.json()
         assert len(data["reply"]) > 10
     
+    def test_coach_concurrent_messages(self):
+        """Test that concurrent messages to one session are all persisted, none overwritten"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        session_id = requests.post(f"{BASE_URL}/v3/coach/start-session", headers=self.headers).json()["session_id"]
+        
+        def send(i):
+            message_data = {"session_id": session_id, "message": f"Quick thought number {i}"}
+            return requests.post(f"{BASE_URL}/v3/coach/message", json=message_data, headers=self.headers)
+        
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(send, range(4)))
+        
+        for response in responses:
+            assert response.status_code == 200
+            assert "reply" in response.json()
+        
+        session = requests.get(f"{BASE_URL}/v3/coach/session/{session_id}", headers=self.headers).json()
+        assert session["message_count"] == 8
+        seqs = [message["seq"] for message in session["messages"]]
+        assert sorted(seqs) == list(range(8))
+        user_turns = {message["content"] for message in session["messages"] if message["role"] == "user"}
+        assert user_turns == {f"Quick thought number {i}" for i in range(4)}
+    
+    def test_coach_message_stream(self):
+        """Test streaming coach reply over Server-Sent Events"""
+        message_data = {
+            "session_id": self.session_id,
+            "message": "I feel overwhelmed with everything on my plate."
+        }
+        
+        response = requests.post(
+            f"{BASE_URL}/v3/coach/message/stream", 
+            json=message_data, 
+            headers=self.headers,
+            stream=True
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        
+        events = [line for line in response.iter_lines(decode_unicode=True) if line.startswith("event:")]
+        assert "event: delta" in events
+        assert events[-1] == "event: done"
+    
+    def test_coach_long_session(self):
+        """Test that a long session keeps answering once older turns are summarized"""
+        session_response = requests.post(
+            f"{BASE_URL}/v3/coach/start-session", 
+            headers=self.headers
+        )
+        long_session_id = session_response.json()["session_id"]
+        
+        for i in range(20):
+            message_data = {
+                "session_id": long_session_id,
+                "message": f"Day {i + 1}: work was stressful again and I slept badly. " * 5
+            }
+            response = requests.post(
+                f"{BASE_URL}/v3/coach/message", 
+                json=message_data, 
+                headers=self.headers
+            )
+            assert response.status_code == 200
+            assert len(response.json()["reply"]) > 5
+        
+        # An oversized message is trimmed to the prompt budget rather than rejected
+        message_data = {"session_id": long_session_id, "message": "I keep overthinking. " * 2000, "language": "en"}
+        response = requests.post(f"{BASE_URL}/v3/coach/message", json=message_data, headers=self.headers)
+        assert response.status_code == 200
+        assert not response.json()["reply"].startswith("I'm having trouble")
+    
     def test_coach_invalid_session(self):
         """Test coach message with invalid session ID"""
         message_data = {
@@ -159,5 +159,33 @@ class TestCSS:
         # Should still work but might return fallback
         assert response.status_code == 200
 
+    def test_css_cache_near_duplicates(self):
+        """Test that near-duplicate inputs are served from the CSS generation cache"""
+        requests.post(f"{BASE_URL}/css/create", json={"emotion_input": "tired", "language": "en"}, headers=self.headers)
+        before = requests.get(f"{BASE_URL}/metrics").json()["css_cache"]
+        
+        response = requests.post(f"{BASE_URL}/css/create", json={"emotion_input": "So tired.", "language": "en"}, headers=self.headers)
+        assert response.status_code == 200
+        
+        after = requests.get(f"{BASE_URL}/metrics").json()["css_cache"]
+        assert after["hits"] + after["refreshes"] > before["hits"] + before["refreshes"]
+        
+        # Contractions are one filler word: "I'm tired" shares the "tired" entry
+        response = requests.post(f"{BASE_URL}/css/create", json={"emotion_input": "I'm tired", "language": "en"}, headers=self.headers)
+        assert response.status_code == 200
+        
+        final = requests.get(f"{BASE_URL}/metrics").json()["css_cache"]
+        assert final["hits"] + final["refreshes"] > after["hits"] + after["refreshes"]
+
+    def test_history_timestamps_iso(self):
+        """Test that stored dates still serialize as ISO strings and page newest first"""
+        first = requests.get(f"{BASE_URL}/css/my-history?limit=2", headers=self.headers).json()
+        assert first["next_cursor"]
+        second = requests.get(f"{BASE_URL}/css/my-history?limit=2&cursor={first['next_cursor']}", headers=self.headers).json()
+
+        stamps = [datetime.fromisoformat(item["timestamp"]) for item in first["history"] + second["history"]]
+        assert stamps[0].tzinfo is not None
+        assert stamps == sorted(stamps, reverse=True)
+
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -1,5 +1,6 @@
 import pytest
 import requests
+import uuid
 from datetime import datetime
 
 BASE_URL = "https://babel-cogito.preview.emergentagent.com/api"
@@ -129,6 +130,34 @@ class TestProfile:
         
         # Handles should be different
         assert profile1["handle"] != profile2["handle"]
+    
+    def test_avatar_generation_job(self):
+        """Test that avatar generation is queued as an idempotent job"""
+        headers = {**self.headers, "Idempotency-Key": f"avatar-{uuid.uuid4()}"}
+        response = requests.post(f"{BASE_URL}/v3/avatar/generate", headers=headers)
+        assert response.status_code == 200
+        job = response.json()
+        assert job["kind"] == "avatar"
+        assert job["status"] in ("queued", "running", "succeeded", "failed")
+        
+        # Same key returns the same job
+        response = requests.post(f"{BASE_URL}/v3/avatar/generate", headers=headers)
+        assert response.json()["id"] == job["id"]
+        
+        response = requests.get(f"{BASE_URL}/v3/jobs/{job['id']}", headers=self.headers)
+        assert response.status_code == 200
+        assert response.json()["id"] == job["id"]
+        
+        response = requests.get(f"{BASE_URL}/v3/jobs/{uuid.uuid4()}", headers=self.headers)
+        assert response.status_code == 404
+    
+    def test_avatar_asset_not_found(self):
+        """Test that unknown or malformed avatar asset keys return 404"""
+        response = requests.get(f"{BASE_URL}/media/avatars/{'0' * 64}.webp")
+        assert response.status_code == 404
+        
+        response = requests.get(f"{BASE_URL}/media/avatars/not-a-key.png")
+        assert response.status_code == 404
 
 if __name__ == "__main__":
     pytest.main([__file__])
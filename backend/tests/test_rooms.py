@@ -77,6 +77,15 @@ class TestRooms:
             assert room.get("is_trending") == True
             assert "member_count" in room
     
+    def test_trending_rooms_ranked_by_activity(self):
+        """Test that activity-ranked rooms come first, highest score first"""
+        rooms = requests.get(f"{BASE_URL}/v3/rooms/trending").json()["rooms"]
+        assert len(rooms) <= 10
+        
+        scores = [room["trending_score"] for room in rooms if "trending_score" in room]
+        assert scores == sorted(scores, reverse=True)
+        assert all("trending_score" in room for room in rooms[:len(scores)])
+    
     def test_join_room(self):
         """Test joining a community room"""
         if not hasattr(self, 'room_id'):
@@ -199,6 +208,37 @@ class TestRooms:
         
         # Should handle gracefully (might return 200 or 404 depending on implementation)
         assert response.status_code in [200, 404]
+    
+    def test_room_dynamics(self):
+        """Test room dynamics with a custom time window"""
+        rooms = requests.get(f"{BASE_URL}/v3/rooms/list").json()["rooms"]
+        if not rooms:
+            pytest.skip("No rooms seeded")
+        
+        room_id = rooms[0]["id"]
+        requests.post(f"{BASE_URL}/v3/rooms/{room_id}/join", headers=self.headers)
+        
+        response = requests.get(f"{BASE_URL}/v3/room/{room_id}/dynamics?window_hours=24")
+        assert response.status_code == 200
+        data = response.json()
+        assert "dynamics" in data
+        if data["dynamics"]:
+            assert data["dynamics"]["window_hours"] == 24
+            assert data["dynamics"]["recent_activity_count"] == sum(data["dynamics"]["emotion_distribution"].values())
+    
+    def test_room_list_localized_etag(self):
+        """Test that the cached room list is localized and answers If-None-Match with 304"""
+        response = requests.get(f"{BASE_URL}/v3/rooms/list?language=en")
+        assert response.status_code == 200
+        for room in response.json()["rooms"]:
+            if "name_en" in room:
+                assert room["name"] == room["name_en"]
+        
+        etag = response.headers.get("ETag")
+        assert etag
+        
+        response = requests.get(f"{BASE_URL}/v3/rooms/list?language=en", headers={"If-None-Match": etag})
+        assert response.status_code == 304
 
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -153,6 +153,53 @@ class TestSocial:
         data = response.json()
         assert len(data["feed"]) <= 5
     
+    def test_global_feed_cursor_pagination(self):
+        """Test paging the global feed with keyset cursors"""
+        first = requests.get(f"{BASE_URL}/v3/social/global-feed?limit=1").json()
+        assert "next_cursor" in first
+        assert "since_cursor" in first
+        
+        if first["next_cursor"]:
+            second = requests.get(f"{BASE_URL}/v3/social/global-feed?limit=1&cursor={first['next_cursor']}").json()
+            assert second["feed"][0]["id"] != first["feed"][0]["id"]
+        
+        # Refreshing with since_cursor only returns items newer than the head we already have
+        refresh = requests.get(f"{BASE_URL}/v3/social/global-feed?since={first['since_cursor']}").json()
+        assert all(item["id"] != first["feed"][0]["id"] for item in refresh["feed"])
+    
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = requests.get(f"{BASE_URL}/v3/social/global-feed?cursor=not-a-cursor")
+        assert response.status_code == 400
+    
+    def test_global_feed_etag(self):
+        """Test that an unchanged global feed answers If-None-Match with 304"""
+        response = requests.get(f"{BASE_URL}/v3/social/global-feed")
+        assert response.status_code == 200
+        etag = response.headers.get("ETag")
+        assert etag
+        
+        response = requests.get(f"{BASE_URL}/v3/social/global-feed", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+    
+    def test_reaction_toggle_and_counts(self):
+        """Test that reacting twice toggles and feeds embed reaction counts"""
+        css_id = requests.get(f"{BASE_URL}/v3/social/global-feed?limit=1").json()["feed"][0]["id"]
+        reaction = {"css_id": css_id, "reaction_type": "wave"}
+        
+        before = requests.get(f"{BASE_URL}/v3/css/{css_id}/reactions").json()["counts"].get("wave", 0)
+        response = requests.post(f"{BASE_URL}/v3/css/react", json=reaction, headers=self.headers2)
+        assert response.status_code == 200
+        assert response.json()["reacted"] is True
+        assert requests.get(f"{BASE_URL}/v3/css/{css_id}/reactions").json()["counts"].get("wave", 0) == before + 1
+        
+        response = requests.post(f"{BASE_URL}/v3/css/react", json=reaction, headers=self.headers2)
+        assert response.json()["reacted"] is False
+        assert requests.get(f"{BASE_URL}/v3/css/{css_id}/reactions").json()["counts"].get("wave", 0) == before
+        
+        feed = requests.get(f"{BASE_URL}/v3/social/global-feed").json()["feed"]
+        assert all("reaction_counts" in item for item in feed)
+    
     def test_social_without_auth(self):
         """Test that social endpoints require authentication"""
         # Follow endpoint
@@ -28,26 +28,22 @@ export default function MoodTimeline() {
     try {
       const days = period === 'daily' ? 1 : period === 'weekly' ? 7 : 30;
       const response = await axios.get(
-        `${API}/v3/mood-journal/timeline?days=${days}`,
+        `${API}/v3/mood-journal/timeline?days=${days}&mode=rollup`,
         getAuthHeader()
       );
       
       const timeline = response.data.timeline || {};
       
-      // Transform timeline data for chart
+      // Transform daily rollups for chart
       const chartData = [];
       Object.keys(timeline).sort().forEach(date => {
-        const cssEntries = timeline[date];
-        if (cssEntries.length > 0) {
-          // Calculate average frequency for the day
-          const avgFreq = cssEntries.reduce((sum, css) => sum + (css.light_frequency || 0.5), 0) / cssEntries.length;
-          const dominantEmotion = cssEntries[0].emotion_label || 'Unknown';
-          
+        const day = timeline[date];
+        if (day.count > 0) {
           chartData.push({
             time: new Date(date).toLocaleDateString('en-US', { month: 'short', day: 'numeric' }),
-            frequency: avgFreq * 100,
-            label: dominantEmotion,
-            count: cssEntries.length
+            frequency: day.mean_frequency * 100,
+            label: day.dominant_emotion || 'Unknown',
+            count: day.count
           });
         }
       });